@@ -0,0 +1,132 @@
+"""
+Deterministic fixtures for offline benchmarks: a small generated PDF
+corpus and a fake embeddings model, so runs are comparable over time and
+need neither the real documents nor API access.
+"""
+import os
+import random
+from langchain_core.embeddings import Embeddings
+
+from rag.embedding_server import fake_embedding
+
+WORDS = (
+    "capital buffer liquidity coverage ratio tier common equity bank risk "
+    "weighted assets leverage exposure supervisory framework basel committee "
+    "credit market operational reserve deposit loan provision stress test "
+    "requirement minimum conservation countercyclical disclosure governance "
+    "compliance regulatory treasury funding interest rate net stable"
+).split()
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages):
+    """Write a minimal text-only PDF with one page per list of lines."""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in below
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+
+    for lines in pages:
+        ops = "BT /F1 9 Tf 40 760 Td 11 TL " + " ".join(
+            f"({_escape(line)}) Tj T*" for line in lines
+        ) + " ET"
+        page_num = len(objects) + 1
+        kids.append(f"{page_num} 0 R")
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_num + 1} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(ops)} >>\nstream\n{ops}\nendstream")
+
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>"
+
+    out = "%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n"
+
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+
+    with open(path, "w", encoding="latin-1") as f:
+        f.write(out)
+
+
+def _paragraph(rng, sentences=6):
+    text = []
+    for _ in range(sentences):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 18))]
+        text.append(" ".join(words).capitalize() + ".")
+    return " ".join(text)
+
+
+def _wrap(text, width=95):
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}".strip()
+    if line:
+        lines.append(line)
+    return lines
+
+
+def make_corpus(out_dir, num_files=6, pages_per_file=30, seed=0):
+    """
+    Generate a deterministic corpus of banking-style PDFs in out_dir.
+
+    Pages carry a running header and footer, like the real annual reports,
+    and the last file repeats sections of the first one, so deduplication
+    and boilerplate stripping have something to find.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    first_file_bodies = []
+
+    paths = []
+    for file_num in range(num_files):
+        title = f"Example Bank {file_num} Annual Report 2024"
+        pages = []
+        for page_num in range(pages_per_file):
+            if file_num > 0 and file_num == num_files - 1 and page_num % 2 == 0:
+                body = first_file_bodies[page_num]
+            else:
+                body = " ".join(_paragraph(rng) for _ in range(4))
+            if file_num == 0:
+                first_file_bodies.append(body)
+
+            lines = [title] + _wrap(body) + [
+                f"Copyright 2024 Example Bank {file_num}. All rights reserved.",
+                f"{page_num + 1}",
+            ]
+            pages.append(lines)
+
+        path = os.path.join(out_dir, f"example_bank_{file_num}_annual_report.pdf")
+        write_pdf(path, pages)
+        paths.append(path)
+
+    return paths
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic stand-in for the OpenAI embeddings model."""
+
+    def __init__(self, dim=1536):
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        return [fake_embedding(text, self.dim) for text in texts]
+
+    def embed_query(self, text):
+        return fake_embedding(text, self.dim)
+
@@ -0,0 +1,276 @@
+"""
+Offline benchmark of the index build.
+
+Generates a small deterministic PDF corpus (or uses --data-dir), embeds it
+with a deterministic fake embeddings model and reports per-stage timings,
+throughput and the estimated embedding cost as JSON:
+
+    python -m benchmarks.index_build --output bench/index_build.json
+
+With --baseline the run fails (exit code 1) if build throughput dropped
+by more than --max-regression compared to an earlier report.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+# the pipeline run should parse every PDF; the page cache is timed separately
+os.environ.setdefault("PAGE_CACHE_DIR", "")
+# loading the reranker tokenizer (a download when not cached) would dominate
+# the pipeline time; tokenization is timed as its own stage
+os.environ.setdefault("RERANK_PRETOKENIZE", "0")
+
+from rag.ingestion import (  # noqa: E402
+    load_pdfs, load_clean_pages, clean_documents, split_documents, new_boilerplate_stats,
+)
+from rag.dedup import NearDuplicateFilter, DEDUP_THRESHOLD  # noqa: E402
+from rag.indexing import (  # noqa: E402
+    BATCH_SIZE, CHUNK_UNIT, CHUNK_SIZE, CHUNK_OVERLAP,
+    _write_batch, index_documents,
+)
+from rag.rerank_tokens import PassageTokenizer  # noqa: E402
+from rag.retrieval import RERANKER_MODEL  # noqa: E402
+from rag.tokens import count_tokens_batch, get_encoding  # noqa: E402
+from rag.vector_store import open_store  # noqa: E402
+from benchmarks.fixtures import FakeEmbeddings, make_corpus  # noqa: E402
+
+# USD per million tokens for text-embedding-3-small
+EMBEDDING_PRICE_PER_1M_TOKENS = 0.02
+GATED_METRICS = ["pages_per_s", "chunks_per_s", "tokens_per_s"]
+
+
+def token_distribution(counts):
+    if not counts:
+        return {}
+    counts = sorted(counts)
+    return {
+        "min": counts[0],
+        "mean": round(sum(counts) / len(counts), 1),
+        "p95": counts[min(len(counts) - 1, int(len(counts) * 0.95))],
+        "max": counts[-1],
+    }
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class StageTimer:
+    def __init__(self):
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        yield
+        self.timings[name] = round(time.perf_counter() - start, 4)
+
+
+def run_stages(data_dir, chroma_dir, embeddings, workers):
+    """Run each build stage to completion before the next, timing each one."""
+    timer = StageTimer()
+
+    with timer.stage("parse"):
+        pages = load_pdfs(data_dir, workers=workers)
+    num_pages = len(pages)
+
+    boilerplate = new_boilerplate_stats()
+    with timer.stage("clean"):
+        pages = clean_documents(pages, boilerplate)
+
+    with timer.stage("split"):
+        chunks = split_documents(pages, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_UNIT)
+
+    num_split = len(chunks)
+    if DEDUP_THRESHOLD > 0:
+        with timer.stage("dedup"):
+            chunks = list(NearDuplicateFilter().filter(chunks))
+
+    texts = [c.text for c in chunks]
+    chunk_tokens = [c.token_count for c in chunks]
+    with timer.stage("embed"):
+        vectors = []
+        for i in range(0, len(texts), BATCH_SIZE):
+            vectors.extend(embeddings.embed_documents(texts[i:i + BATCH_SIZE]))
+
+    db = open_store(chroma_dir, embeddings)
+    with timer.stage("write"):
+        for i in range(0, len(chunks), BATCH_SIZE):
+            _write_batch(db, chunks[i:i + BATCH_SIZE], vectors[i:i + BATCH_SIZE])
+        db.save()
+
+    # only if the tokenizer is cached, so an offline run does not wait on downloads
+    try:
+        tokenizer = PassageTokenizer(RERANKER_MODEL, local_files_only=True)
+    except Exception as e:
+        print(f"Not timing reranker tokenization: {e}")
+    else:
+        with timer.stage("rerank_tokens"):
+            for i in range(0, len(texts), BATCH_SIZE):
+                tokenizer.encode(texts[i:i + BATCH_SIZE])
+
+    return timer.timings, num_pages, texts, chunk_tokens, num_split - len(chunks), boilerplate
+
+
+def measure_ingest_memory(data_dir, workers):
+    """
+    Python heap used by parse -> clean -> split -> dedup, traced with
+    tracemalloc in a separate untimed run: the peak, and what the chunks
+    still hold once ingestion is done.
+    """
+    tracemalloc.start()
+    try:
+        pages = clean_documents(load_pdfs(data_dir, workers=workers))
+        chunks = split_documents(pages, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_UNIT)
+        del pages
+        if DEDUP_THRESHOLD > 0:
+            chunks = list(NearDuplicateFilter().filter(chunks))
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "peak_mb": round(peak / (1024 * 1024), 2),
+        "retained_mb": round(retained / (1024 * 1024), 2),
+        "bytes_per_chunk": round(retained / max(1, len(chunks))),
+    }
+
+
+def run_page_cache(data_dir, cache_dir, workers):
+    """Time loading cleaned pages with an empty, then a filled page cache."""
+    timings = {}
+    for run in ["cold", "warm"]:
+        start = time.perf_counter()
+        load_clean_pages(data_dir, workers=workers, cache_dir=cache_dir)
+        timings[run] = round(time.perf_counter() - start, 4)
+    return timings
+
+
+def run_pipeline(data_dir, chroma_dir, embeddings):
+    """Time the real streaming build end to end."""
+    start = time.perf_counter()
+    index_documents(reset=True, data_dir=data_dir, chroma_path=chroma_dir,
+                    embeddings=embeddings)
+    return round(time.perf_counter() - start, 4)
+
+
+def run_benchmark(data_dir=None, files=6, pages=30, workers=1, dim=1536, verbose=False):
+    embeddings = FakeEmbeddings(dim=dim)
+    fixture = "generated" if data_dir is None else data_dir
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if data_dir is None:
+            data_dir = os.path.join(tmp, "documents")
+            make_corpus(data_dir, num_files=files, pages_per_file=pages)
+
+        output = sys.stdout if verbose else io.StringIO()
+        with contextlib.redirect_stdout(output):
+            stages, num_pages, texts, chunk_tokens, duplicates, boilerplate = run_stages(
+                data_dir, os.path.join(tmp, "staged_db"), embeddings, workers
+            )
+            pipeline_s = run_pipeline(data_dir, os.path.join(tmp, "pipeline_db"), embeddings)
+            page_cache_s = run_page_cache(data_dir, os.path.join(tmp, "pages"), workers)
+            ingest_memory = measure_ingest_memory(data_dir, workers)
+
+        num_files = len([f for f in os.listdir(data_dir) if f.endswith(".pdf")])
+
+    tokens = sum(count_tokens_batch(texts))
+    # without tiktoken data the counts are ~4 characters per token
+    tokens_estimated = get_encoding() is None
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {
+            "fixture": fixture,
+            "workers": workers,
+            "batch_size": BATCH_SIZE,
+            "chunk_unit": CHUNK_UNIT,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "dedup_threshold": DEDUP_THRESHOLD,
+            "embedding_dim": dim,
+        },
+        "corpus": {
+            "files": num_files,
+            "pages": num_pages,
+            "chunks": len(texts),
+            "near_duplicates_dropped": duplicates,
+            "boilerplate_lines_stripped": boilerplate["lines"],
+            "boilerplate_chars_saved": boilerplate["chars"],
+            "boilerplate_tokens_saved": boilerplate["tokens"],
+            "characters": sum(len(t) for t in texts),
+            "tokens": tokens,
+            "tokens_estimated": tokens_estimated,
+            "chunk_tokens": token_distribution(chunk_tokens),
+        },
+        "stages_s": stages,
+        "pipeline_s": pipeline_s,
+        "page_cache_s": page_cache_s,
+        "throughput": {
+            "pages_per_s": round(num_pages / pipeline_s, 2),
+            "chunks_per_s": round(len(texts) / pipeline_s, 2),
+            "tokens_per_s": round(tokens / pipeline_s, 2),
+        },
+        "estimated_embedding_cost_usd": round(tokens / 1e6 * EMBEDDING_PRICE_PER_1M_TOKENS, 6),
+        "ingest_memory": ingest_memory,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def check_regression(report, baseline, max_regression):
+    """Return a list of throughput metrics that fell below the allowed floor."""
+    failures = []
+    for metric in GATED_METRICS:
+        old = baseline["throughput"].get(metric)
+        new = report["throughput"][metric]
+        if old and new < old * (1 - max_regression):
+            failures.append(f"{metric}: {new} vs baseline {old}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the index build offline.")
+    parser.add_argument("--data-dir", help="PDF directory to use instead of the generated fixtures")
+    parser.add_argument("--files", type=int, default=6, help="number of generated PDFs")
+    parser.add_argument("--pages", type=int, default=30, help="pages per generated PDF")
+    parser.add_argument("--workers", type=int, default=1, help="PDF parsing processes")
+    parser.add_argument("--dim", type=int, default=1536, help="fake embedding dimensions")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="JSON report to compare throughput against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed relative throughput drop vs the baseline")
+    parser.add_argument("--verbose", action="store_true", help="show pipeline output")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.data_dir, args.files, args.pages, args.workers,
+                           args.dim, args.verbose)
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = check_regression(report, baseline, args.max_regression)
+        if failures:
+            print("Throughput regression:\n  " + "\n  ".join(failures))
+            sys.exit(1)
+        print("No throughput regression against baseline")
@@ -0,0 +1,233 @@
+"""
+Evaluation of the rerank cascade (rag.rerank_cascade) on labelled
+queries against the current index: for full reranking and for each
+combination of thresholds, the retrieval latency (vector search plus
+reranking, p50/p99), the share of cross-encoder pairs skipped, and the
+ranking quality of the top k (nDCG, MRR and recall against the labels,
+and agreement of the top-k set with full reranking).
+
+    python -m benchmarks.rerank_cascade --labels eval/labels.jsonl --output bench/cascade.json
+    python -m benchmarks.rerank_cascade --labels eval/labels.jsonl --margins 0.1,0.2,0.3 \\
+        --windows 0,0.3,0.5 --max-ndcg-drop 0.01
+
+Each line of the labels file is a query with the pages that answer it,
+pages counted from 1 as in the citations:
+
+    {"query": "What is the CET1 ratio?", "relevant": [{"source": "report.pdf", "page": 12}]}
+
+A chunk is relevant if its page, or a page its deduplicated text also
+appears on, is labelled. The report recommends the fastest thresholds
+whose nDCG is within --max-ndcg-drop of full reranking, and with
+--max-ndcg-drop the run exits with an error if the configured ones
+(CASCADE_* environment variables) are not. The rerank score cache is
+disabled so every run pays for the pairs it scores. Needs the index,
+the query embeddings API (or QUERY_CACHE_DIR) and the reranker model.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+from benchmarks.vector_store import percentile_ms
+
+
+def load_labels(path):
+    labels = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                relevant = {(r["source"], int(r["page"])) for r in item["relevant"]}
+                labels.append((item["query"], relevant))
+    return labels
+
+
+def doc_pages(doc):
+    """(source, page from 1) of a chunk and of every copy of its text."""
+    from rag.dedup import parse_also_in
+
+    pages = {(doc.metadata.get("source", "Unknown"), doc.metadata.get("page", 0) + 1)}
+    pages.update((source, page + 1) for source, page in parse_also_in(doc.metadata.get("also_in")))
+    return pages
+
+
+def ranking_quality(results, relevant, k):
+    """
+    nDCG@k, reciprocal rank and recall@k of the labelled pages (binary
+    relevance). A chunk only gains for labelled pages no higher-ranked
+    chunk already found, so several chunks of one page count once and
+    nDCG stays within [0, 1].
+    """
+    found, gains = set(), []
+    for doc, _ in results[:k]:
+        pages = doc_pages(doc) & relevant
+        gains.append(bool(pages - found))
+        found |= pages
+    dcg = sum(gain / math.log2(rank + 2) for rank, gain in enumerate(gains))
+    ideal = sum(1 / math.log2(rank + 2) for rank in range(min(len(relevant), k)))
+    hits = [rank for rank, (doc, _) in enumerate(results[:k]) if doc_pages(doc) & relevant]
+    return {
+        "ndcg": dcg / ideal if ideal else 0.0,
+        "mrr": 1 / (hits[0] + 1) if hits else 0.0,
+        "recall": len(found) / len(relevant) if relevant else 0.0,
+    }
+
+
+def threshold_grid(few_candidates, margins, windows):
+    return [{"few_candidates": few, "margin": margin, "window": window}
+            for few, margin, window in itertools.product(few_candidates, margins, windows)]
+
+
+def _config_name(thresholds):
+    if thresholds is None:
+        return "full"
+    return ",".join(f"{name}={value}" for name, value in thresholds.items())
+
+
+def run_benchmark(labels, grid, k=5, repeats=3):
+    # no cached scores: each configuration pays for the pairs it scores
+    os.environ["RERANK_CACHE_SIZE"] = "0"
+    from rag import retrieval
+    from rag.rerank_cascade import RerankCascade
+
+    configured = RerankCascade().thresholds()
+    configs = [None] + [t for t in grid if t != configured] + [configured]
+
+    # one index version for the whole run, even if a new one is published
+    with retrieval.index_in_use() as (db, tokens, version):
+        results, per_query = _run_configs(db, tokens, labels, configs, configured, k, repeats)
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {
+            "num_queries": len(labels),
+            "k": k,
+            "repeats": repeats,
+            "index": version,
+            "backend": retrieval.RERANKER_BACKEND,
+            "configured": _config_name(configured),
+        },
+        "results": results,
+        "queries": per_query,
+    }
+
+
+def _run_configs(db, tokens, labels, configs, configured, k, repeats):
+    from rag import retrieval
+    from rag.rerank_cascade import RerankCascade
+
+    # the query vectors are cached after this, so search times are comparable
+    candidates, search_times = [], []
+    for query, _ in labels:
+        retrieval.search_candidates(db, query, k)
+        start = time.perf_counter()
+        candidates.append(retrieval.search_candidates(db, query, k))
+        search_times.append(time.perf_counter() - start)
+    # load and warm up the reranker
+    for (query, _), hits in zip(labels, candidates):
+        if hits:
+            retrieval.rerank_results(query, hits, top_k=k, tokens=tokens)
+            break
+
+    full_top = {}
+    results = {}
+    per_query = []
+    for thresholds in configs:
+        name = _config_name(thresholds)
+        cascade = None if thresholds is None else RerankCascade(**thresholds)
+        latencies, quality, agreement = [], [], 0
+        actions = {"skip": 0, "shrink": 0, "rerank": 0}
+        pairs_scored = pairs = 0
+
+        for i, ((query, relevant), hits) in enumerate(zip(labels, candidates)):
+            times = []
+            for _ in range(repeats):
+                report = {}
+                start = time.perf_counter()
+                ranked = retrieval.rerank_results(query, hits, top_k=k, cascade=cascade,
+                                                  report=report, tokens=tokens)
+                times.append(time.perf_counter() - start)
+            latencies.append(search_times[i] + min(times))
+            if hits:
+                actions[report.get("action", "rerank")] += 1
+                pairs_scored += report.get("reranked", len(hits))
+                pairs += len(hits)
+            quality.append(ranking_quality(ranked, relevant, k))
+
+            top = {doc.id for doc, _ in ranked}
+            if thresholds is None:
+                full_top[i] = top
+            agreement += top == full_top[i]
+            if thresholds == configured:
+                per_query.append({"query": query, **report, **quality[-1]})
+
+        results[name] = {
+            "thresholds": thresholds,
+            "retrieval_p50_ms": percentile_ms(latencies, 50),
+            "retrieval_p99_ms": percentile_ms(latencies, 99),
+            **{metric: round(sum(q[metric] for q in quality) / len(quality), 4)
+               for metric in ("ndcg", "mrr", "recall")},
+            "top_k_agreement": round(agreement / len(labels), 4),
+            **actions,
+            "pairs_scored": pairs_scored,
+            "skipped_rate": round(1 - pairs_scored / pairs, 3) if pairs else 0.0,
+        }
+
+    return results, per_query
+
+
+def recommend(report, max_ndcg_drop):
+    """The fastest configuration whose nDCG is within max_ndcg_drop of full reranking."""
+    full = report["results"]["full"]
+    eligible = [(result["retrieval_p50_ms"], name)
+                for name, result in report["results"].items()
+                if result["ndcg"] >= full["ndcg"] - max_ndcg_drop]
+    return min(eligible)[1]
+
+
+def _floats(text):
+    return [float(value) for value in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the rerank cascade on labelled queries.")
+    parser.add_argument("--labels", required=True, help="JSONL file of labelled queries")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--few-candidates", default="1,2",
+                        help="comma-separated values of CASCADE_FEW_CANDIDATES to try")
+    parser.add_argument("--margins", default="0,0.1,0.2,0.3",
+                        help="comma-separated values of CASCADE_MARGIN to try")
+    parser.add_argument("--windows", default="0,0.2,0.4",
+                        help="comma-separated values of CASCADE_WINDOW to try")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="rerank each query this many times and keep the fastest")
+    parser.add_argument("--max-ndcg-drop", type=float,
+                        help="fail if the configured thresholds lose more nDCG than this")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    grid = threshold_grid([int(v) for v in args.few_candidates.split(",")],
+                          _floats(args.margins), _floats(args.windows))
+    report = run_benchmark(load_labels(args.labels), grid, args.k, args.repeats)
+    report["recommended"] = recommend(report, args.max_ndcg_drop or 0.0)
+    print(json.dumps({name: {key: value for key, value in result.items() if key != "thresholds"}
+                      for name, result in report["results"].items()}, indent=2))
+    print(f"Recommended: {report['recommended']}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.max_ndcg_drop is not None:
+        full = report["results"]["full"]["ndcg"]
+        configured = report["results"][report["config"]["configured"]]["ndcg"]
+        if configured < full - args.max_ndcg_drop:
+            print(f"Cascade check failed: nDCG {configured} with the configured thresholds "
+                  f"vs {full} with full reranking")
+            sys.exit(1)
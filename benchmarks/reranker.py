@@ -0,0 +1,255 @@
+"""
+Offline comparison of the reranker backends (RERANKER_BACKEND) on the
+same generated query/passage pairs: score parity of the ONNX int8 model
+with the PyTorch CrossEncoder, per-query latency (p50/p99) for a
+retrieval-sized candidate list, bulk throughput, and the memory a worker
+pays to load and run the model.
+
+    python -m benchmarks.reranker --output bench/reranker.json
+    python -m benchmarks.reranker --max-score-diff 0.5 --min-top-agreement 0.9
+
+With --clients, each backend is also run under concurrent load: that
+many threads send queries back to back to one shared model, once calling
+it directly and once through the micro-batching worker
+(rag.rerank_batcher), reporting queries/s, p50/p99 latency and the
+average batch size for each.
+
+    python -m benchmarks.reranker --clients 1,4,16 --batch-size 64 --batch-wait-ms 5
+
+With thresholds, the run exits with an error if the ONNX scores drift
+from the PyTorch ones by more than --max-score-diff (in logits) or the
+top-k candidates per query agree less often than --min-top-agreement.
+Each backend runs in its own process so its memory use (including the
+torch or onnxruntime import) is measured in isolation. The models must
+be available locally or downloadable; see rag.onnx_reranker for the
+export.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import numpy as np
+
+from benchmarks.fixtures import WORDS
+from benchmarks.vector_store import rss_mb, percentile_ms, _in_new_process
+
+
+def make_pairs(num_queries, candidates, seed=0):
+    """One list of (query, passage) pairs per query, passages of varied length."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        query = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 10))) + "?"
+        passages = []
+        for _ in range(candidates):
+            # half the passages share words with the query, like real candidates
+            vocab = WORDS if rng.random() < 0.5 else query.rstrip("?").split() + WORDS[:10]
+            passages.append(" ".join(rng.choice(vocab) for _ in range(rng.randint(40, 300))))
+        queries.append([(query, passage) for passage in passages])
+    return queries
+
+
+def run_backend(backend, num_queries, candidates, bulk_pairs, seed, model_name=None):
+    from rag.retrieval import load_reranker
+
+    queries = make_pairs(num_queries, candidates, seed)
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    reranker = load_reranker(backend, model_name)
+    load_s = time.perf_counter() - start
+    rss_loaded = rss_mb()
+
+    for pairs in queries[:3]:
+        reranker.predict(pairs)
+
+    scores, latencies = [], []
+    for pairs in queries:
+        start = time.perf_counter()
+        scores.append(np.asarray(reranker.predict(pairs), dtype=np.float32).tolist())
+        latencies.append(time.perf_counter() - start)
+
+    bulk = [pair for pairs in make_pairs(-(-bulk_pairs // candidates), candidates, seed + 1)
+            for pair in pairs][:bulk_pairs]
+    start = time.perf_counter()
+    reranker.predict(bulk)
+    bulk_s = time.perf_counter() - start
+
+    rss_after = rss_mb()
+    return {
+        "load_s": round(load_s, 3),
+        "query_p50_ms": percentile_ms(latencies, 50),
+        "query_p99_ms": percentile_ms(latencies, 99),
+        "bulk_pairs_per_s": round(len(bulk) / bulk_s, 1),
+        "memory_loaded_mb": None if rss_before is None else round(rss_loaded - rss_before, 1),
+        "memory_mb": None if rss_before is None else round(rss_after - rss_before, 1),
+    }, scores
+
+
+def _closed_loop(predict, queries, clients, duration_s):
+    """clients threads scoring queries back to back for duration_s: (queries/s, latencies)."""
+    latencies = [[] for _ in range(clients)]
+    stop = time.perf_counter() + duration_s
+
+    def client(n):
+        i = n
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            predict(queries[i % len(queries)])
+            latencies[n].append(time.perf_counter() - start)
+            i += clients
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for client_latencies in latencies for latency in client_latencies]
+    return len(latencies) / elapsed, latencies
+
+
+def run_load(backend, client_counts, num_queries, candidates, seed, batch_size, batch_wait_ms,
+             duration_s, model_name=None):
+    """Throughput and latency under concurrent load, direct and micro-batched."""
+    from rag.retrieval import load_reranker
+    from rag.rerank_batcher import RerankBatcher
+
+    queries = make_pairs(num_queries, candidates, seed)
+    reranker = load_reranker(backend, model_name)
+    batcher = RerankBatcher(reranker, max_batch_size=batch_size, max_wait_ms=batch_wait_ms)
+    for pairs in queries[:3]:
+        reranker.predict(pairs)
+
+    results = {}
+    for clients in client_counts:
+        for mode, model in (("direct", reranker), ("batched", batcher)):
+            before = batcher.stats()
+            throughput, latencies = _closed_loop(model.predict, queries, clients, duration_s)
+            after = batcher.stats()
+            batches = after["batches"] - before["batches"]
+            results[f"{mode}@{clients}"] = {
+                "clients": clients,
+                "queries_per_s": round(throughput, 1),
+                "p50_ms": percentile_ms(latencies, 50),
+                "p99_ms": percentile_ms(latencies, 99),
+                "pairs_per_batch": round((after["pairs"] - before["pairs"]) / batches, 1)
+                if batches else None,
+            }
+    return results
+
+
+def compare_scores(reference, scores, top_k):
+    """Score differences and how often both rankings pick the same top k."""
+    diffs, agree = [], 0
+    for ref, other in zip(reference, scores):
+        ref, other = np.asarray(ref), np.asarray(other)
+        diffs.append(np.abs(ref - other))
+        agree += set(np.argsort(-ref)[:top_k]) == set(np.argsort(-other)[:top_k])
+    diffs = np.concatenate(diffs)
+    return {
+        "max_abs_diff": round(float(diffs.max()), 4),
+        "mean_abs_diff": round(float(diffs.mean()), 4),
+        "top_k_agreement": round(agree / len(reference), 4),
+    }
+
+
+def run_benchmark(backends=("torch", "onnx"), num_queries=50, candidates=10, bulk_pairs=2000,
+                  top_k=5, seed=0, clients=(), batch_size=64, batch_wait_ms=5.0,
+                  load_duration_s=10.0, model_name=None):
+    results, scores = {}, {}
+    for backend in backends:
+        results[backend], scores[backend] = _in_new_process(
+            run_backend, backend, num_queries, candidates, bulk_pairs, seed, model_name,
+        )
+        if clients:
+            results[backend]["load"] = _in_new_process(
+                run_load, backend, clients, num_queries, candidates, seed, batch_size,
+                batch_wait_ms, load_duration_s, model_name,
+            )
+
+    from rag.retrieval import RERANKER_MODEL
+
+    reference = backends[0]
+    for backend in backends[1:]:
+        results[backend]["parity"] = compare_scores(scores[reference], scores[backend], top_k)
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {
+            "num_queries": num_queries,
+            "candidates": candidates,
+            "bulk_pairs": bulk_pairs,
+            "top_k": top_k,
+            "reference": reference,
+            "model": model_name or RERANKER_MODEL,
+            "clients": list(clients),
+            "batch_size": batch_size,
+            "batch_wait_ms": batch_wait_ms,
+        },
+        "backends": results,
+    }
+
+
+def check_parity(report, max_score_diff, min_top_agreement):
+    failures = []
+    for backend, result in report["backends"].items():
+        parity = result.get("parity")
+        if parity is None:
+            continue
+        if max_score_diff is not None and parity["max_abs_diff"] > max_score_diff:
+            failures.append(f"{backend}: max score diff {parity['max_abs_diff']} > {max_score_diff}")
+        if min_top_agreement is not None and parity["top_k_agreement"] < min_top_agreement:
+            failures.append(f"{backend}: top-k agreement {parity['top_k_agreement']} "
+                            f"< {min_top_agreement}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the reranker backends offline.")
+    parser.add_argument("--backends", default="torch,onnx",
+                        help="comma-separated backends; the first is the parity reference")
+    parser.add_argument("--model", help="cross-encoder name or path (default: RERANKER_MODEL); "
+                                        "the ONNX backend needs it exported first")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--candidates", type=int, default=10,
+                        help="pairs per query (retrieve_context reranks up to k * 2)")
+    parser.add_argument("--bulk-pairs", type=int, default=2000)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--clients", default="",
+                        help="comma-separated numbers of concurrent clients for the load test")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="most pairs per forward pass of the batching worker")
+    parser.add_argument("--batch-wait-ms", type=float, default=5.0,
+                        help="longest a request waits for others to share its pass")
+    parser.add_argument("--load-duration", type=float, default=10.0,
+                        help="seconds of load per client count and mode")
+    parser.add_argument("--max-score-diff", type=float,
+                        help="fail if any score differs from the reference by more")
+    parser.add_argument("--min-top-agreement", type=float,
+                        help="fail if the top-k sets agree for a smaller share of queries")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.backends.split(","), args.queries, args.candidates,
+                           args.bulk_pairs, args.top_k,
+                           clients=[int(n) for n in args.clients.split(",") if n],
+                           batch_size=args.batch_size, batch_wait_ms=args.batch_wait_ms,
+                           load_duration_s=args.load_duration, model_name=args.model)
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    failures = check_parity(report, args.max_score_diff, args.min_top_agreement)
+    if failures:
+        print("Reranker parity check failed:\n  " + "\n  ".join(failures))
+        sys.exit(1)
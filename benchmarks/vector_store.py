@@ -0,0 +1,221 @@
+"""
+Offline comparison of the vector store backends on the same synthetic
+corpus: build time, query latency (p50/p99), memory, size on disk and
+recall@k against exact search.
+
+    python -m benchmarks.vector_store --num-vectors 20000 --output bench/vector_store.json
+
+Vectors are unit-length samples around random cluster centres, like
+embeddings of a corpus on a few topics; queries are fresh samples around
+the same centres. Each backend runs in its own process so its memory use
+is measured in isolation.
+
+--search-dims also runs each backend on vectors truncated to these
+dimensions with full-vector rescoring (SEARCH_DIM), to measure the recall
+lost. Synthetic vectors spread their information evenly over all
+dimensions, unlike text-embedding-3 vectors, so for a realistic figure
+use real embeddings: --from-index reads the vectors of a built index
+version (without writing to it) and holds out --queries of them as queries.
+
+    python -m benchmarks.vector_store --from-index chroma_db/versions/v... --search-dims 0,256,512
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+from rag.vector_store import STORES, ChromaStore, FullVectorStore, build_store, open_store  # noqa: E402
+
+
+def make_vectors(num_vectors, num_queries, dim, clusters=50, spread=0.6, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+
+    def sample(n):
+        points = centres[rng.integers(0, clusters, n)]
+        points = points + spread * rng.standard_normal((n, dim)).astype(np.float32)
+        return points / np.linalg.norm(points, axis=1, keepdims=True)
+
+    return sample(num_vectors), sample(num_queries)
+
+
+def index_vectors(index_path):
+    """
+    The full vectors of the index version at index_path. Only stores that
+    exist there are opened: creating a Chroma client on a version built
+    without one would add an empty collection to a published version.
+    """
+    # the searched store of a truncated index only has the truncated vectors
+    if FullVectorStore.exists(index_path):
+        return FullVectorStore(index_path).vectors()
+
+    for store in STORES.values():
+        if store is not ChromaStore and store.exists(index_path):
+            vectors = store(index_path).vectors()
+            if vectors is not None:
+                return vectors
+    if ChromaStore.exists(index_path):
+        chroma = ChromaStore(index_path)
+        pages = [np.asarray(page_vectors, dtype=np.float32)
+                 for _, page_vectors, _, _ in chroma.iter_items()]
+        chroma.close()
+        if pages:
+            return np.concatenate(pages)
+    raise ValueError(f"No index with float vectors at {index_path}")
+
+
+def load_vectors(num_vectors, num_queries, dim, seed, from_index=None):
+    """(vectors, queries): synthetic, or held out from the index at from_index."""
+    if from_index is None:
+        return make_vectors(num_vectors, num_queries, dim, seed=seed)
+
+    vectors = np.array(index_vectors(from_index), dtype=np.float32)
+    np.random.default_rng(seed).shuffle(vectors)
+    return vectors[num_queries:], vectors[:num_queries]
+
+
+def exact_neighbours(vectors, queries, k):
+    distances = -2.0 * queries @ vectors.T  # unit vectors: |q - v|^2 = 2 - 2 q.v
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+def rss_mb():
+    """Current resident set size, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def dir_size_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total / (1024 * 1024)
+
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def build_backend(backend, index_dir, num_vectors, num_queries, dim, seed,
+                  search_dim=0, from_index=None):
+    vectors, _ = load_vectors(num_vectors, num_queries, dim, seed, from_index)
+    num_vectors = len(vectors)
+    ids = [f"c{i}" for i in range(num_vectors)]
+    texts = [f"chunk {i}" for i in range(num_vectors)]
+    metadatas = [{"source": "synthetic.pdf", "page": i // 10, "chunk_id": i}
+                 for i in range(num_vectors)]
+
+    start = time.perf_counter()
+    build_store(index_dir, ids, vectors, texts, metadatas, backend=backend,
+                search_dim=search_dim)
+    return time.perf_counter() - start
+
+
+def query_backend(backend, index_dir, num_vectors, num_queries, dim, k, seed,
+                  from_index=None):
+    vectors, queries = load_vectors(num_vectors, num_queries, dim, seed, from_index)
+    truth = exact_neighbours(vectors, queries, k)
+    del vectors
+
+    # memory of a reader: open the saved index and serve queries
+    rss_before = rss_mb()
+    store = open_store(index_dir, backend=backend)
+    for query in queries[:10]:
+        store.search(query, k)
+
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        results = store.search(query, k)
+        latencies.append(time.perf_counter() - start)
+        found = {doc.metadata["chunk_id"] for doc, _ in results}
+        hits += len(found & set(expected.tolist()))
+    rss_after = rss_mb()
+
+    return {
+        "query_p50_ms": percentile_ms(latencies, 50),
+        "query_p99_ms": percentile_ms(latencies, 99),
+        f"recall_at_{k}": round(hits / (len(queries) * k), 4),
+        "memory_mb": None if rss_before is None else round(rss_after - rss_before, 1),
+        "count": store.count(),
+    }
+
+
+def _in_new_process(fn, *args):
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(fn, *args).result()
+
+
+def run_benchmark(backends, num_vectors=20000, num_queries=200, dim=1536, k=10, seed=0,
+                  search_dims=(0,), from_index=None):
+    if from_index is not None:
+        vectors, queries = load_vectors(num_vectors, num_queries, dim, seed, from_index)
+        num_vectors, num_queries, dim = len(vectors), len(queries), vectors.shape[1]
+        del vectors, queries
+
+    results = {}
+    for backend in backends:
+        for search_dim in search_dims:
+            # build and query in fresh processes, so the reader's memory is
+            # measured without anything left over from the build or other backends
+            with tempfile.TemporaryDirectory() as index_dir:
+                build_s = _in_new_process(build_backend, backend, index_dir, num_vectors,
+                                          num_queries, dim, seed, search_dim, from_index)
+                name = f"{backend}@{search_dim}" if search_dim else backend
+                results[name] = {
+                    "search_dim": search_dim or dim,
+                    "build_s": round(build_s, 3),
+                    **_in_new_process(query_backend, backend, index_dir, num_vectors,
+                                      num_queries, dim, k, seed, from_index),
+                    "disk_mb": round(dir_size_mb(index_dir), 1),
+                }
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {
+            "num_vectors": num_vectors,
+            "num_queries": num_queries,
+            "dim": dim,
+            "k": k,
+            "vectors": from_index or "synthetic",
+        },
+        "backends": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the vector store backends offline.")
+    parser.add_argument("--backends", default=",".join(STORES),
+                        help="comma-separated backends to compare")
+    parser.add_argument("--num-vectors", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--search-dims", default="0",
+                        help="comma-separated SEARCH_DIM values to run (0: full vectors)")
+    parser.add_argument("--from-index",
+                        help="use the vectors of this Chroma index directory instead of synthetic ones")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.backends.split(","), args.num_vectors, args.queries,
+                           args.dim, args.k,
+                           search_dims=[int(d) for d in args.search_dims.split(",")],
+                           from_index=args.from_index)
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
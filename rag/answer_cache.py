@@ -0,0 +1,123 @@
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# cosine similarity of question embeddings above which a cached answer is
+# reused for a paraphrase; 1 (or more) only reuses exact matches
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+
+def normalize_question(question):
+    return " ".join(question.split()).casefold()
+
+
+class AnswerCache:
+    """
+    Two-tier cache of answers from ask().
+
+    The exact tier matches the normalized question and k; the semantic
+    tier matches a question whose embedding has a cosine similarity of at
+    least `similarity` with a cached one (same k). Entries belong to the
+    index version they were answered from and are all dropped when it
+    changes; otherwise the least recently used entries are evicted beyond
+    max_size, and entries expire ttl seconds after they were stored.
+    """
+
+    def __init__(self, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                 similarity=ANSWER_CACHE_SIMILARITY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+
+        self._lock = threading.Lock()
+        # (normalized question, k) -> (expires_at, unit vector or None, result)
+        self._entries = OrderedDict()
+        self._index_version = None
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @property
+    def semantic(self):
+        return self.similarity < 1
+
+    def _check_version(self, index_version):
+        if index_version != self._index_version:
+            self._entries.clear()
+            self._index_version = index_version
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _, _) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+
+    def get(self, question, k, index_version):
+        """Exact lookup; returns a copy of the cached result, or None."""
+        key = (normalize_question(question), k)
+
+        with self._lock:
+            self._check_version(index_version)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return copy.deepcopy(entry[2])
+
+    def get_similar(self, vector, k, index_version):
+        """Semantic lookup by question embedding; returns a copy of the result, or None."""
+        if vector is None or not self.semantic:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        vector = np.asarray(vector, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+
+        with self._lock:
+            self._check_version(index_version)
+            self._expire()
+            candidates = [(key, entry[1]) for key, entry in self._entries.items()
+                          if key[1] == k and entry[1] is not None]
+            if candidates:
+                scores = np.stack([v for _, v in candidates]) @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity:
+                    key = candidates[best][0]
+                    self._entries.move_to_end(key)
+                    self.semantic_hits += 1
+                    return copy.deepcopy(self._entries[key][2])
+
+            self.misses += 1
+            return None
+
+    def put(self, question, k, index_version, result, vector=None):
+        key = (normalize_question(question), k)
+        if vector is not None:
+            vector = np.asarray(vector, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+
+        with self._lock:
+            self._check_version(index_version)
+            self._entries[key] = (time.monotonic() + self.ttl, vector, copy.deepcopy(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            hits = self.exact_hits + self.semantic_hits
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,182 @@
+import os
+import re
+import zlib
+import numpy as np
+
+# estimated Jaccard similarity of word 5-gram sets above which two chunks
+# count as the same text; 0 disables deduplication
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+NUM_PERM = 128
+BANDS = 16
+SHINGLE_SIZE = 5
+# kept chunks' signatures, stored with each index version
+SIGNATURES_FILE = "dedup_signatures.npz"
+
+_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = (1 << 32) - 1
+
+
+def _shingles(text, k=SHINGLE_SIZE):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= k:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + k]) for i in range(len(words) - k + 1)]
+    return np.array([zlib.crc32(g.encode("utf-8")) for g in set(grams)], dtype=np.uint64)
+
+
+def format_location(source, page):
+    return f"{source}:{page}"
+
+
+def parse_also_in(value):
+    """Turn an also_in metadata string back into [(source, page), ...]."""
+    locations = []
+    for item in (value or "").split("|"):
+        source, sep, page = item.rpartition(":")
+        if sep and page.isdigit():
+            locations.append((source, int(page)))
+    return locations
+
+
+class NearDuplicateFilter:
+    """
+    Streaming near-duplicate detector using MinHash signatures and
+    locality-sensitive hashing over word shingles.
+
+    Works on Chunk records. The first occurrence of a text is kept; later
+    chunks whose estimated Jaccard similarity to a kept chunk reaches the
+    threshold are dropped, and their source/page is appended to the kept
+    chunk's "also_in" ("file.pdf:12|other.pdf:3", pages 0-based like
+    "page") so citations can still point at every place the text appears.
+
+    Only the signature, ID, location and "also_in" of each kept chunk are
+    held, not its text. New "also_in" values are collected in updated
+    (chunk ID -> value) for the caller to write, since the kept chunk may
+    have been written already. save() stores the kept chunks with an index
+    version and load() reads them back, so an incremental build compares
+    new files with the chunks already indexed.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=NUM_PERM, bands=BANDS, seed=1):
+        rng = np.random.default_rng(seed)
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._a = rng.integers(1, _MAX_HASH, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MAX_HASH, num_perm, dtype=np.uint64)
+
+        self._buckets = {}
+        # per kept chunk
+        self._signatures = []
+        self._ids = []
+        self._locations = []  # (source, page)
+        self._also_in = []
+
+        self.dropped = 0
+        self.updated = {}  # chunk ID -> "also_in" of a kept chunk that gained entries
+        self.links = {}  # source -> sources it shares near-duplicate text with
+
+    def _signature(self, text):
+        shingles = _shingles(text)
+        hashes = (np.outer(shingles, self._a) + self._b) % _PRIME
+        # the low 32 bits are as good for estimating similarity, at half the size
+        return hashes.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [
+            (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def _keep(self, signature, chunk_id, source, page, also_in, keys=None):
+        idx = len(self._signatures)
+        self._signatures.append(signature)
+        self._ids.append(chunk_id)
+        self._locations.append((source, page))
+        self._also_in.append(also_in)
+        for key in keys or self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(idx)
+
+    def check(self, chunk):
+        """Return True if the chunk should be kept, False if it is a near-duplicate."""
+        signature = self._signature(chunk.text)
+        keys = self._band_keys(signature)
+
+        candidates = set()
+        for key in keys:
+            candidates.update(self._buckets.get(key, ()))
+
+        for idx in sorted(candidates):
+            similarity = np.mean(self._signatures[idx] == signature)
+            if similarity >= self.threshold:
+                self._merge(idx, chunk)
+                return False
+
+        self._keep(signature, chunk.id, chunk.source, chunk.page, chunk.also_in, keys)
+        return True
+
+    def _merge(self, idx, duplicate):
+        source, page = self._locations[idx]
+        location = format_location(duplicate.source, duplicate.page)
+
+        locations = self._also_in[idx].split("|") if self._also_in[idx] else []
+        if location not in locations and location != format_location(source, page):
+            locations.append(location)
+            self._also_in[idx] = "|".join(locations)
+            self.updated[self._ids[idx]] = self._also_in[idx]
+
+        if duplicate.source != source:
+            self.links.setdefault(source, set()).add(duplicate.source)
+            self.links.setdefault(duplicate.source, set()).add(source)
+        self.dropped += 1
+
+    def filter(self, chunks):
+        """Yield only the chunks that are not near-duplicates of earlier ones."""
+        for chunk in chunks:
+            if self.check(chunk):
+                yield chunk
+
+    def save(self, index_path):
+        """Store the kept chunks in index_path (written atomically)."""
+        path = os.path.join(index_path, SIGNATURES_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        signatures = np.array(self._signatures, dtype=np.uint32).reshape(-1, self.num_perm)
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f, signatures=signatures,
+                ids=np.array(self._ids, dtype=str),
+                sources=np.array([source for source, _ in self._locations], dtype=str),
+                pages=np.array([page for _, page in self._locations], dtype=np.int64),
+                also_in=np.array(self._also_in, dtype=str),
+            )
+        os.replace(tmp_path, path)
+
+    def load(self, index_path, exclude_sources=()):
+        """
+        Add the kept chunks stored in index_path, except those of
+        exclude_sources (files being re-indexed or removed), whose pages
+        are also dropped from the others' "also_in". Returns False if there
+        are none stored.
+        """
+        path = os.path.join(index_path, SIGNATURES_FILE)
+        if not os.path.exists(path):
+            return False
+
+        exclude_sources = set(exclude_sources)
+        with np.load(path) as saved:
+            if saved["signatures"].shape[1:] != (self.num_perm,):
+                return False
+            for signature, chunk_id, source, page, also_in in zip(
+                saved["signatures"], saved["ids"], saved["sources"], saved["pages"],
+                saved["also_in"],
+            ):
+                if str(source) in exclude_sources:
+                    continue
+                kept = "|".join(format_location(s, p) for s, p in parse_also_in(str(also_in))
+                                if s not in exclude_sources)
+                if kept != also_in:
+                    self.updated[str(chunk_id)] = kept
+                self._keep(signature, str(chunk_id), str(source), int(page), kept)
+        return True
@@ -0,0 +1,183 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import openai
+from langchain_core.embeddings import Embeddings
+from .tokens import count_tokens, get_encoding
+
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+# provider limits for one embeddings request
+EMBED_MAX_TOKENS = int(os.getenv("EMBED_MAX_TOKENS", "300000"))
+EMBED_MAX_INPUTS = 2048
+EMBED_MAX_INPUT_TOKENS = 8191
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "8"))
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+def pack_requests(token_counts, max_tokens=EMBED_MAX_TOKENS, max_inputs=EMBED_MAX_INPUTS):
+    """
+    Group consecutive inputs into requests that stay within the per-request
+    token and input limits. Returns a list of (start, end) index ranges.
+    """
+    requests = []
+    start, tokens = 0, 0
+
+    for i, n in enumerate(token_counts):
+        if i > start and (tokens + n > max_tokens or i - start >= max_inputs):
+            requests.append((start, i))
+            start, tokens = i, 0
+        tokens += n
+
+    if start < len(token_counts):
+        requests.append((start, len(token_counts)))
+
+    return requests
+
+
+class AdaptiveLimiter:
+    """
+    Caps the number of requests in flight. The cap is halved and all
+    callers pause when the provider answers 429, and grows back by one
+    after a run of successful requests.
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.limit = max_in_flight
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, rate_limited=False, retry_after=0.0):
+        with self._cond:
+            self.in_flight -= 1
+
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_in_flight:
+                    self.limit += 1
+                    self._successes = 0
+
+            self._cond.notify_all()
+
+
+def _retry_after(error, attempt):
+    """Seconds to wait before retrying: the server's Retry-After, else exponential backoff."""
+    response = getattr(error, "response", None)
+    header = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(header)
+    except (TypeError, ValueError):
+        return min(60.0, 0.5 * 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+class ConcurrentEmbeddings(Embeddings):
+    """
+    OpenAI embeddings client that packs texts into requests by token count
+    and sends up to max_in_flight requests at once, backing off adaptively
+    when rate limited.
+
+    The client honours OPENAI_BASE_URL, so it can be pointed at the local
+    stand-in server in rag.embedding_server.
+    """
+
+    def __init__(self, model, max_in_flight=EMBED_CONCURRENCY,
+                 max_tokens=EMBED_MAX_TOKENS, client=None):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.client = client or openai.OpenAI(max_retries=0)
+        # None offline without a tiktoken cache: token counts are estimated
+        self.encoding = get_encoding()
+        self.limiter = AdaptiveLimiter(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.tokens = 0
+
+    def _request(self, inputs, num_tokens):
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            self.limiter.acquire()
+            try:
+                response = self.client.embeddings.create(model=self.model, input=inputs)
+            except RETRYABLE_ERRORS as e:
+                rate_limited = isinstance(e, openai.RateLimitError)
+                delay = _retry_after(e, attempt)
+                self.limiter.release(rate_limited=rate_limited, retry_after=delay)
+
+                with self._stats_lock:
+                    self.rate_limited += rate_limited
+                if attempt == EMBED_MAX_RETRIES:
+                    raise
+                if not rate_limited:
+                    time.sleep(delay)
+                continue
+            except BaseException:
+                self.limiter.release()
+                raise
+
+            self.limiter.release()
+            with self._stats_lock:
+                self.requests += 1
+                self.tokens += num_tokens
+
+            data = sorted(response.data, key=lambda d: d.index)
+            return [d.embedding for d in data]
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+
+        # inputs over the model's limit are truncated rather than rejected
+        inputs = []
+        for text in texts:
+            if self.encoding is None:
+                text = text[:EMBED_MAX_INPUT_TOKENS * 4]
+                inputs.append((text, max(1, count_tokens(text))))
+                continue
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) > EMBED_MAX_INPUT_TOKENS:
+                tokens = tokens[:EMBED_MAX_INPUT_TOKENS]
+                text = self.encoding.decode(tokens)
+            inputs.append((text, max(1, len(tokens))))
+
+        ranges = pack_requests([n for _, n in inputs], max_tokens=self.max_tokens)
+        futures = [
+            self._executor.submit(
+                self._request,
+                [text for text, _ in inputs[start:end]],
+                sum(n for _, n in inputs[start:end]),
+            )
+            for start, end in ranges
+        ]
+
+        vectors = []
+        for future in futures:
+            vectors.extend(future.result())
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
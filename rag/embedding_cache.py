@@ -0,0 +1,485 @@
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows: the cache is only safe within one process
+    fcntl = None
+
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", ".cache/embeddings")
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "86400"))
+# a directory (e.g. EMBED_CACHE_DIR) to also keep query vectors on disk
+QUERY_CACHE_DIR = os.getenv("QUERY_CACHE_DIR", "")
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of embedding vectors keyed by (model, normalized text hash).
+
+    Vectors are appended to one raw float32 file per model and read back
+    through a memory map; a small SQLite database maps each key to its row
+    in that file and tracks when it was embedded and last used, for
+    expiry and pruning.
+
+    Several processes can share a cache directory: every operation holds
+    an exclusive lock on its lock file (on POSIX systems), and compaction
+    writes a new vector file that replaces the old one in the same SQLite
+    transaction as the new row numbers.
+    """
+
+    def __init__(self, cache_dir=EMBED_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(cache_dir, "lock"), "a")
+        self._conn = sqlite3.connect(
+            os.path.join(cache_dir, "index.sqlite3"), check_same_thread=False
+        )
+        with self._locked():
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS models (
+                    model TEXT PRIMARY KEY,
+                    dim INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    row INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                );
+            """)
+            # added later; caches written before have every entry at generation 0
+            self._add_column("models", "generation", "INTEGER NOT NULL DEFAULT 0")
+            self._add_column("embeddings", "created", "REAL")
+
+    def _add_column(self, table, column, declaration):
+        columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+            self._conn.commit()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _vector_path(self, model, generation=0):
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        if generation:
+            return os.path.join(self.cache_dir, f"{safe_name}.{generation}.f32")
+        return os.path.join(self.cache_dir, f"{safe_name}.f32")
+
+    def _model(self, model):
+        """(dim, generation of the vector file) of a model, or (None, 0)."""
+        row = self._conn.execute(
+            "SELECT dim, generation FROM models WHERE model = ?", (model,)
+        ).fetchone()
+        return tuple(row) if row else (None, 0)
+
+    def _vectors(self, model, dim, generation=0):
+        path = self._vector_path(model, generation)
+        # whole rows only: a killed append can leave part of a row behind
+        rows = os.path.getsize(path) // (4 * dim) if os.path.exists(path) else 0
+        if rows == 0:
+            return np.zeros((0, dim), dtype=np.float32)
+        return np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dim))
+
+    def _lookup_rows(self, model, hashes):
+        hashes = list(hashes)
+        rows = {}
+        # stay below SQLite's limit on bound parameters
+        for i in range(0, len(hashes), 500):
+            part = hashes[i:i + 500]
+            placeholders = ",".join("?" * len(part))
+            rows.update(self._conn.execute(
+                f"SELECT text_hash, row FROM embeddings "
+                f"WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *part],
+            ).fetchall())
+        return rows
+
+    def get_many(self, model, texts, max_age=None):
+        """
+        Return a list with the cached vector for each text, or None.
+        Entries embedded more than max_age seconds ago are removed instead.
+        """
+        hashes = [text_hash(t) for t in texts]
+
+        with self._locked():
+            dim, generation = self._model(model)
+            if dim is None:
+                return [None] * len(texts)
+
+            if max_age is not None:
+                self._expire(model, set(hashes), time.time() - max_age)
+            rows = self._lookup_rows(model, set(hashes))
+            if rows:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in rows],
+                )
+                self._conn.commit()
+
+            # the map stays readable if compaction replaces the file
+            vectors = self._vectors(model, dim, generation)
+
+        return [
+            np.array(vectors[rows[h]]).tolist() if h in rows else None
+            for h in hashes
+        ]
+
+    def _expire(self, model, hashes, cutoff):
+        # entries from before "created" was recorded count from their last use
+        hashes = list(hashes)
+        for i in range(0, len(hashes), 500):
+            part = hashes[i:i + 500]
+            placeholders = ",".join("?" * len(part))
+            self._conn.execute(
+                f"DELETE FROM embeddings WHERE model = ? AND text_hash IN ({placeholders}) "
+                f"AND COALESCE(created, last_used) < ?",
+                [model, *part, cutoff],
+            )
+        self._conn.commit()
+
+    def put_many(self, model, texts, vectors):
+        if not texts:
+            return
+
+        new = {}
+        for text, vector in zip(texts, vectors):
+            new.setdefault(text_hash(text), vector)
+
+        with self._locked():
+            known = self._lookup_rows(model, new)
+            new = {h: v for h, v in new.items() if h not in known}
+            if not new:
+                return
+
+            array = np.asarray(list(new.values()), dtype=np.float32)
+            dim, generation = self._model(model)
+            if dim is None:
+                dim = array.shape[1]
+                self._conn.execute(
+                    "INSERT INTO models (model, dim) VALUES (?, ?)", (model, dim)
+                )
+            elif dim != array.shape[1]:
+                raise ValueError(
+                    f"Cached {model} vectors have {dim} dims, got {array.shape[1]}"
+                )
+
+            path = self._vector_path(model, generation)
+            start_row = os.path.getsize(path) // (4 * dim) if os.path.exists(path) else 0
+
+            # vectors are written before their keys are committed, so a crash
+            # can only leave unreferenced rows (dropped by the next prune);
+            # a partly written row is cut off so the next ones stay aligned
+            with open(path, "ab") as f:
+                f.truncate(start_row * 4 * dim)
+                f.write(array.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            now = time.time()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, row, last_used, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(model, h, start_row + i, now, now) for i, h in enumerate(new)],
+            )
+            self._conn.commit()
+
+    def stats(self):
+        """Return entry count and bytes on disk for each cached model."""
+        with self._locked():
+            models = self._conn.execute(
+                "SELECT m.model, m.dim, m.generation, COUNT(e.text_hash) FROM models m "
+                "LEFT JOIN embeddings e ON e.model = m.model GROUP BY m.model"
+            ).fetchall()
+
+        stats = {}
+        for model, dim, generation, entries in models:
+            path = self._vector_path(model, generation)
+            stats[model] = {
+                "dim": dim,
+                "entries": entries,
+                "bytes": os.path.getsize(path) if os.path.exists(path) else 0,
+            }
+        return stats
+
+    def total_bytes(self):
+        index_bytes = os.path.getsize(os.path.join(self.cache_dir, "index.sqlite3"))
+        return index_bytes + sum(s["bytes"] for s in self.stats().values())
+
+    def prune(self, max_bytes=None, max_age_days=None):
+        """
+        Drop entries not used for max_age_days, then least recently used
+        entries until the vector files fit in max_bytes, and compact the
+        vector files. Returns the number of entries removed.
+        """
+        removed = 0
+
+        with self._locked():
+            if max_age_days is not None:
+                cutoff = time.time() - max_age_days * 86400
+                removed += self._conn.execute(
+                    "DELETE FROM embeddings WHERE last_used < ?", (cutoff,)
+                ).rowcount
+
+            if max_bytes is not None:
+                entries = self._conn.execute(
+                    "SELECT e.model, e.text_hash, m.dim FROM embeddings e "
+                    "JOIN models m ON m.model = e.model ORDER BY e.last_used DESC"
+                ).fetchall()
+                used = 0
+                drop = []
+                for model, h, dim in entries:
+                    used += 4 * dim
+                    if used > max_bytes:
+                        drop.append((model, h))
+                self._conn.executemany(
+                    "DELETE FROM embeddings WHERE model = ? AND text_hash = ?", drop
+                )
+                removed += len(drop)
+
+            self._conn.commit()
+
+            for (model,) in self._conn.execute("SELECT model FROM models").fetchall():
+                self._compact(model)
+
+            self._conn.execute("VACUUM")
+
+        return removed
+
+    def _compact(self, model):
+        dim, generation = self._model(model)
+        entries = self._conn.execute(
+            "SELECT text_hash, row FROM embeddings WHERE model = ? ORDER BY row",
+            (model,),
+        ).fetchall()
+
+        path = self._vector_path(model, generation)
+        vectors = self._vectors(model, dim, generation)
+        if len(entries) == len(vectors):
+            return
+
+        # the kept vectors go to the next generation's file, which the rows
+        # switch to in one commit: a crash leaves either the old file and
+        # rows or the new ones
+        new_path = self._vector_path(model, generation + 1)
+        tmp_path = new_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for i in range(0, len(entries), 4096):
+                rows = [row for _, row in entries[i:i + 4096]]
+                f.write(np.asarray(vectors[rows], dtype=np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        del vectors
+        os.replace(tmp_path, new_path)
+
+        self._conn.executemany(
+            "UPDATE embeddings SET row = ? WHERE model = ? AND text_hash = ?",
+            [(new_row, model, h) for new_row, (h, _) in enumerate(entries)],
+        )
+        self._conn.execute(
+            "UPDATE models SET generation = ? WHERE model = ?", (generation + 1, model)
+        )
+        self._conn.commit()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model so documents already in the cache are served
+    from disk and only unseen text is sent to the provider.
+    """
+
+    def __init__(self, embeddings, model, cache=None):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache or EmbeddingCache()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        vectors = self.cache.get_many(self.model, texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            new_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+            self.cache.put_many(self.model, [texts[i] for i in missing], new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+
+        return vectors
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model with a bounded, thread-safe LRU cache of
+    query vectors keyed by normalized query text, so repeated questions
+    (e.g. the suggested topics) skip the embeddings request entirely.
+    Concurrent misses for the same query share one request.
+
+    Entries expire ttl seconds after they were embedded. With cache_dir,
+    vectors are also kept in an on-disk EmbeddingCache that survives
+    restarts and is shared between processes, with the same ttl; that tier
+    is trimmed with `python -m rag.embedding_cache prune`.
+    """
+
+    def __init__(self, embeddings, model, max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL,
+                 cache_dir=QUERY_CACHE_DIR):
+        self.embeddings = embeddings
+        self.model = model
+        self.max_size = max_size
+        self.ttl = ttl
+        self.disk = EmbeddingCache(cache_dir) if cache_dir else None
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # normalized text -> (expires_at, vector)
+        self._in_flight = {}  # normalized text -> Future of its vector
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, vector = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def _put(self, key, vector):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def embed_query(self, text):
+        key = normalize_text(text)
+
+        vector = self._get(key)
+        if vector is not None:
+            return list(vector)
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+            else:
+                self.hits += 1
+        if not owner:
+            return list(future.result())
+
+        try:
+            vector = self._load(key)
+            future.set_result(vector)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+        return list(vector)
+
+    def _load(self, key):
+        if self.disk is not None:
+            vector = self.disk.get_many(self.model, [key], max_age=self.ttl)[0]
+            if vector is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._put(key, vector)
+                return vector
+
+        vector = self.embeddings.embed_query(key)
+        with self._lock:
+            self.misses += 1
+        self._put(key, vector)
+        if self.disk is not None:
+            self.disk.put_many(self.model, [key], [vector])
+        return vector
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+
+def _format_bytes(n):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or prune the embedding cache.")
+    parser.add_argument("--dir", default=EMBED_CACHE_DIR, help="cache directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="show cache size per model")
+    prune_parser = commands.add_parser("prune", help="remove old or excess entries")
+    prune_parser.add_argument("--max-mb", type=float, help="keep vectors under this size")
+    prune_parser.add_argument("--max-age-days", type=float, help="drop entries unused for this long")
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(args.dir)
+
+    if args.command == "prune":
+        max_bytes = int(args.max_mb * 1024 * 1024) if args.max_mb is not None else None
+        removed = cache.prune(max_bytes=max_bytes, max_age_days=args.max_age_days)
+        print(f"Removed {removed} entries")
+
+    for model, s in cache.stats().items():
+        print(f"{model}: {s['entries']} entries, {s['dim']} dims, {_format_bytes(s['bytes'])}")
+    print(f"Total on disk: {_format_bytes(cache.total_bytes())}")
@@ -0,0 +1,140 @@
+"""
+Local stand-in for the OpenAI embeddings endpoint, for exercising the
+indexing pipeline without network access or API cost.
+
+    python -m rag.embedding_server --latency 0.3 --rate-limit-prob 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test python -m rag.indexing
+
+Vectors are derived deterministically from the input text. The server can
+add latency per request, reject a share of requests with 429, and reject
+any request beyond a concurrency cap with 429.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+
+def fake_embedding(text, dim=1536):
+    """Deterministic unit vector for a text, stable across runs and platforms."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+    server_version = "FakeEmbeddings/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _rate_limited(self):
+        self.server.stats["rate_limited"] += 1
+        self._send_json(
+            429,
+            {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+            headers={"retry-after": str(self.server.retry_after)},
+        )
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        server = self.server
+
+        with server.lock:
+            server.stats["requests"] += 1
+            over_capacity = server.in_flight >= server.max_concurrent
+            if not over_capacity:
+                server.in_flight += 1
+
+        if over_capacity or random.random() < server.rate_limit_prob:
+            self._rate_limited()
+            if not over_capacity:
+                with server.lock:
+                    server.in_flight -= 1
+            return
+
+        try:
+            time.sleep(server.latency)
+
+            inputs = body["input"]
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            dim = body.get("dimensions") or server.dim
+
+            data = [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(str(text), dim)}
+                for i, text in enumerate(inputs)
+            ]
+            tokens = sum(len(str(text)) // 4 for text in inputs)
+            self._send_json(200, {
+                "object": "list",
+                "data": data,
+                "model": body.get("model"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            })
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def make_server(host="127.0.0.1", port=8765, latency=0.0, rate_limit_prob=0.0,
+                max_concurrent=1000, retry_after=0.5, dim=1536, verbose=False):
+    """Create (but do not start) the stand-in server; port=0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), EmbeddingHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.rate_limit_prob = rate_limit_prob
+    server.max_concurrent = max_concurrent
+    server.retry_after = retry_after
+    server.dim = dim
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.stats = {"requests": 0, "rate_limited": 0}
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in embeddings server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds added to every request")
+    parser.add_argument("--rate-limit-prob", type=float, default=0.0,
+                        help="share of requests answered with 429")
+    parser.add_argument("--max-concurrent", type=int, default=1000,
+                        help="requests beyond this many in flight get 429")
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host, args.port, args.latency, args.rate_limit_prob,
+        args.max_concurrent, args.retry_after, args.dim, args.verbose,
+    )
+    print(f"Serving fake embeddings on http://{args.host}:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"{server.stats['requests']} requests, {server.stats['rate_limited']} rate limited")
@@ -1,82 +1,525 @@
+import argparse
+import json
 import os
-import shutil
+import queue
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
 
-from .ingestion import run_ingestion
+from .ingestion import (
+    find_pdfs, iter_clean_pages, iter_chunks, new_boilerplate_stats, format_boilerplate_stats,
+    BOILERPLATE_MIN_RATIO, CHUNK_UNIT, CHUNK_SIZE, CHUNK_OVERLAP,
+)
+from .dedup import NearDuplicateFilter, DEDUP_THRESHOLD, SIGNATURES_FILE
+from .embedding import ConcurrentEmbeddings, EMBED_CONCURRENCY
+from .embedding_cache import CachedEmbeddings, EMBED_CACHE_DIR
+from .page_cache import file_hash
+from .rerank_tokens import RerankTokenStore, PassageTokenizer, RERANK_PRETOKENIZE, TOKENS_FILE
+from .retrieval import RERANKER_MODEL
+from .vector_store import (
+    open_store, get_store_class, discard_other_stores, VECTOR_BACKEND, SEARCH_DIM,
+)
+from .versions import (
+    current_index_path, start_build, pending_build, discard_build, publish_build,
+)
 
 load_dotenv()
 
 CHROMA_PATH = "chroma_db"
-COLLECTION_NAME = "rag_docs"
 DATA_DIR = "data/documents"
+EMBEDDING_MODEL = "text-embedding-3-small"
+# chunks per vector-store write; embedding requests are packed by token count
 BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "1000"))
+QUEUE_SIZE = int(os.getenv("INDEX_QUEUE_SIZE", "2"))
+MANIFEST_FILE = "index_manifest.json"
+CHECKPOINT_FILE = "index_checkpoint.jsonl"
+# batches between saves (and checkpoints) of stores that are not durable per write
+SAVE_EVERY = int(os.getenv("INDEX_SAVE_EVERY", "10"))
 
 
-def db_exists():
-    return (
-        os.path.isdir(CHROMA_PATH)
-        and os.path.exists(os.path.join(CHROMA_PATH, "chroma.sqlite3"))
-    )
+def db_exists(chroma_path=CHROMA_PATH):
+    index_path = current_index_path(chroma_path)
+    return os.path.isdir(index_path) and get_store_class().exists(index_path)
 
 
-def clear_database():
-    if os.path.exists(CHROMA_PATH):
-        shutil.rmtree(CHROMA_PATH)
-        print("Cleared existing database")
+def _chunking_params():
+    return {
+        "chunk_unit": CHUNK_UNIT,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "dedup_threshold": DEDUP_THRESHOLD,
+        "boilerplate_min_ratio": BOILERPLATE_MIN_RATIO,
+        # not a chunking parameter, but switching stores must rewrite every file
+        "vector_backend": VECTOR_BACKEND,
+        "search_dim": SEARCH_DIM,
+    }
 
 
-def get_chunk_id(chunk):
-    source = chunk.metadata.get("source", "unknown")
-    page = chunk.metadata.get("page", 0)
-    chunk_num = chunk.metadata.get("chunk_id", 0)
-    return f"{source}:p{page}:c{chunk_num}"
+def load_manifest(index_path):
+    """
+    Read the manifest recording, for every indexed PDF, its content hash
+    and the chunk IDs it produced, plus the chunking parameters used.
+    """
+    path = os.path.join(index_path, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
 
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
 
-def index_documents(reset=False):
-    start_time = time.time()
 
-    if not reset and db_exists():
-        print("Vector database already exists. Skipping indexing.")
-        print("Run with reset=True to rebuild.")
+def save_manifest(index_path, manifest):
+    path = os.path.join(index_path, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(index_path):
+    """
+    Return the chunk IDs recorded as written by an interrupted build, or
+    None if there is no usable checkpoint. The checkpoint is a JSON-lines
+    log: a header with the chunking parameters, then one line per written
+    batch. A torn last line from a crash mid-write is ignored.
+    """
+    path = os.path.join(index_path, CHECKPOINT_FILE)
+    if not os.path.exists(path):
         return None
 
-    if reset:
-        clear_database()
+    committed = set()
+    with open(path, encoding="utf-8") as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            return None
+        if header.get("chunking") != _chunking_params():
+            print("Checkpoint was written with different chunking parameters, ignoring it")
+            return None
+
+        for line in f:
+            try:
+                committed.update(json.loads(line)["ids"])
+            except (ValueError, KeyError):
+                break
+
+    return committed
+
+
+def _start_checkpoint(index_path):
+    path = os.path.join(index_path, CHECKPOINT_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"chunking": _chunking_params()}) + "\n")
+
+
+def _record_checkpoint(index_path, ids):
+    path = os.path.join(index_path, CHECKPOINT_FILE)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"ids": ids}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def clear_checkpoint(index_path):
+    path = os.path.join(index_path, CHECKPOINT_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def plan_update(pdf_files, manifest, reindex_all=False):
+    """
+    Compare the PDFs on disk with the manifest (with reindex_all, every
+    file counts as changed).
+
+    Returns (to_index, stale_ids, hashes): the files that were added or
+    changed, the chunk IDs that must be deleted because their file changed
+    or was removed, and the current hash of every file.
+
+    Files that shared near-duplicate chunks with a changed or removed file
+    are re-indexed too, since their kept chunks or "also_in" pointers
+    depend on it, and so are the files linked to those in turn.
+    """
+    hashes = {p.name: file_hash(p) for p in pdf_files}
+    indexed = manifest["files"] if manifest else {}
+
+    if manifest and manifest.get("chunking") != _chunking_params():
+        print("Chunking parameters changed, re-indexing every file")
+        indexed_hashes = {}
+    elif reindex_all:
+        indexed_hashes = {}
+    else:
+        indexed_hashes = {name: entry["sha256"] for name, entry in indexed.items()}
+
+    to_index = [p for p in pdf_files if indexed_hashes.get(p.name) != hashes[p.name]]
+    to_index_names = {p.name for p in to_index}
+    num_changed = len(to_index)
 
-    print("Loading and chunking documents...")
-    chunks = run_ingestion(DATA_DIR)
-    total = len(chunks)
+    pending = [name for name in indexed if name not in hashes or name in to_index_names]
+    seen = set(pending)
+    while pending:
+        for name in indexed.get(pending.pop(), {}).get("linked", []):
+            if name not in seen:
+                seen.add(name)
+                pending.append(name)
+    linked = {name for name in seen if name in hashes and name not in to_index_names}
+    if linked:
+        to_index = [p for p in pdf_files if p.name in to_index_names or p.name in linked]
+        to_index_names.update(linked)
 
-    print(f"Indexing {total} chunks (batch size: {BATCH_SIZE})...")
+    stale_ids = []
+    for name, entry in indexed.items():
+        if name not in hashes or name in to_index_names:
+            stale_ids.extend(entry["chunk_ids"])
 
-    embeddings = OpenAIEmbeddings(
-        model="text-embedding-3-small",
-        chunk_size=BATCH_SIZE,
+    added = sum(1 for p in to_index if p.name not in indexed)
+    removed = sum(1 for name in indexed if name not in hashes)
+    print(f"{added} added, {num_changed - added} changed, {removed} removed, "
+          f"{len(linked)} linked by duplicates, {len(pdf_files) - len(to_index)} unchanged")
+
+    return to_index, stale_ids, hashes
+
+
+def get_chunk_id(chunk):
+    return chunk.id
+
+
+def _prefetch(iterable, maxsize=QUEUE_SIZE):
+    """
+    Run an iterator in a background thread and hand its items over through
+    a bounded queue, so the next pipeline stage can work while this one
+    produces. Exceptions in the producer are re-raised in the consumer.
+
+    When the consumer stops early (or raises), the producer closes the
+    iterator, so upstream stages such as iter_pdfs' worker pool shut down,
+    and is joined before this generator returns.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(("item", item)):
+                    return
+            put(("done", None))
+        except BaseException as e:
+            put(("error", e))
+        finally:
+            # a generator can only be closed by the thread running it
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            kind, value = items.get()
+            if kind == "done":
+                return
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        stop.set()
+        producer.join()
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _embed_batches(batches, embeddings, window=EMBED_CONCURRENCY):
+    """Embed up to `window` batches at once, yielding (batch, vectors) in order."""
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        pending = deque()
+        for batch in batches:
+            texts = [c.text for c in batch]
+            pending.append((batch, executor.submit(embeddings.embed_documents, texts)))
+            if len(pending) >= window:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+
+
+def _write_batch(db, batch, vectors):
+    # Chunk records become metadata dicts only here, at the store boundary
+    db.add(
+        ids=[get_chunk_id(c) for c in batch],
+        vectors=vectors,
+        texts=[c.text for c in batch],
+        metadatas=[c.metadata for c in batch],
     )
 
-    chunk_ids = [get_chunk_id(c) for c in chunks]
 
-    db = None
-    for i in range(0, total, BATCH_SIZE):
-        batch_end = min(i + BATCH_SIZE, total)
-        batch_chunks = chunks[i:batch_end]
-        batch_ids = chunk_ids[i:batch_end]
+def _open_token_store(index_path):
+    """
+    The side store of reranker token IDs and the tokenizer that fills
+    it, or (None, None) when disabled or the tokenizer is unavailable.
+    A store copied from the previous version is then removed, since it
+    would miss or misstate the chunks this build rewrites.
+    """
+    tokenizer = None
+    if RERANK_PRETOKENIZE:
+        try:
+            tokenizer = PassageTokenizer(RERANKER_MODEL)
+        except Exception as e:  # e.g. offline without the tokenizer cached
+            print(f"Not storing reranker tokens: {e}")
+
+    if tokenizer is None:
+        if RerankTokenStore.exists(index_path):
+            os.remove(os.path.join(index_path, TOKENS_FILE))
+        return None, None
+    return RerankTokenStore(index_path, RERANKER_MODEL, tokenizer.vocab_size), tokenizer
+
 
-        print(f"Processing {i+1}-{batch_end} of {total}...")
+def _skip_committed(chunks, committed, ids_by_source):
+    """Record every chunk's ID, but only pass on chunks not yet written."""
+    for chunk in chunks:
+        chunk_id = get_chunk_id(chunk)
+        ids_by_source.setdefault(chunk.source, []).append(chunk_id)
 
-        if db is None:
-            db = Chroma.from_documents(
-                documents=batch_chunks,
-                embedding=embeddings,
-                ids=batch_ids,
-                persist_directory=CHROMA_PATH,
-                collection_name=COLLECTION_NAME,
-            )
+        if chunk_id not in committed:
+            yield chunk
+
+
+def _write_dedup_updates(db, dedup_filter):
+    """Persist "also_in" pointers added to chunks after they were written."""
+    updated = list(dedup_filter.updated.items())
+    for i in range(0, len(updated), BATCH_SIZE):
+        batch = updated[i:i + BATCH_SIZE]
+        db.update_metadata(
+            ids=[chunk_id for chunk_id, _ in batch],
+            metadatas=[{"also_in": also_in} for _, also_in in batch],
+        )
+
+
+def _delete_ids(db, ids):
+    for i in range(0, len(ids), BATCH_SIZE):
+        db.delete(ids[i:i + BATCH_SIZE])
+
+
+def _open_db(index_path, embeddings, search_dim=None):
+    return open_store(index_path, embeddings, search_dim=search_dim)
+
+
+def index_documents(reset=False, resume=False, data_dir=DATA_DIR,
+                    chroma_path=CHROMA_PATH, embeddings=None):
+    """
+    Build or update the vector database as a streaming pipeline:
+    parse/clean PDFs (or read them from the page cache) -> split -> embed -> write.
+
+    Each stage runs in its own thread and passes work on through a small
+    bounded queue (INDEX_QUEUE_SIZE), so embedding of the first file
+    overlaps with parsing of the rest and memory use does not grow with
+    the size of the corpus.
+
+    Builds go into a new version directory (a copy of the current index
+    for incremental updates, an empty one with reset) that is published
+    atomically once complete, so the live index is never modified and
+    readers pick up the new version without a restart.
+
+    Unless reset is set, only PDFs that were added or changed since the
+    last build (per the manifest) are indexed, and chunks of changed or
+    removed PDFs are deleted.
+
+    Every written batch is recorded in a checkpoint. With resume, a build
+    that was interrupted continues where it stopped: chunks already
+    written are neither re-embedded nor written again.
+
+    embeddings: use this embeddings model instead of the OpenAI API
+    (e.g. a deterministic fake for offline benchmarks); the embedding
+    cache is bypassed.
+    """
+    start_time = time.time()
+
+    base_path = None
+    build_path = pending_build(chroma_path) if resume else None
+    committed = load_checkpoint(build_path) if build_path else None
+    if resume and committed is None:
+        print("No checkpoint found, starting a new build")
+        build_path = None
+
+    if committed is not None:
+        print(f"Resuming build {build_path}: {len(committed)} chunks already written")
+        manifest = load_manifest(build_path)
+    else:
+        committed = set()
+        if not reset and db_exists(chroma_path):
+            base_path = current_index_path(chroma_path)
+        manifest = load_manifest(base_path) if base_path else None
+
+        # vectors of another dimensionality cannot be updated in place
+        if base_path and (manifest or {}).get("chunking", {}).get("search_dim", 0) != SEARCH_DIM:
+            print(f"SEARCH_DIM changed to {SEARCH_DIM}, rebuilding the index from scratch")
+            base_path = manifest = None
+
+        if manifest is None and base_path:
+            print("No index manifest found, indexing every file "
+                  "(existing chunks with the same IDs are overwritten)")
+
+    # new files are only compared with indexed chunks whose signatures were stored
+    dedup_path = build_path or base_path
+    reindex_all = False
+    if DEDUP_THRESHOLD > 0 and manifest and not os.path.exists(
+            os.path.join(dedup_path, SIGNATURES_FILE)):
+        print("No near-duplicate signatures stored with the index, re-indexing every file")
+        reindex_all = True
+
+    pdf_files = find_pdfs(data_dir)
+    to_index, stale_ids, hashes = plan_update(pdf_files, manifest, reindex_all)
+
+    # only used by the store to embed queries
+    query_embeddings = embeddings
+    if query_embeddings is None:
+        query_embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+
+    if not to_index and not stale_ids:
+        if build_path:
+            discard_build(chroma_path, build_path)
+        print("Index is up to date.")
+        return _open_db(current_index_path(chroma_path), query_embeddings)
+
+    if build_path is None:
+        build_path = start_build(chroma_path, base_path)
+        _start_checkpoint(build_path)
+    print(f"Building index version {build_path}")
+
+    api_embeddings = None
+    doc_embeddings = embeddings
+    if doc_embeddings is None:
+        api_embeddings = ConcurrentEmbeddings(model=EMBEDDING_MODEL)
+        doc_embeddings = api_embeddings
+        # an empty EMBED_CACHE_DIR disables the cache
+        if EMBED_CACHE_DIR:
+            doc_embeddings = CachedEmbeddings(api_embeddings, model=EMBEDDING_MODEL)
+
+    db = _open_db(build_path, query_embeddings, search_dim=SEARCH_DIM)
+    token_store, passage_tokenizer = _open_token_store(build_path)
+
+    # IDs rewritten before the interruption belong to the new version of a file
+    stale_ids = [i for i in stale_ids if i not in committed]
+    if stale_ids:
+        print(f"Deleting {len(stale_ids)} stale chunks...")
+        _delete_ids(db, stale_ids)
+        if token_store is not None:
+            token_store.delete(stale_ids)
+
+    print(f"Streaming {len(to_index)} files into the index (batch size: {BATCH_SIZE})...")
+
+    boilerplate_stats = new_boilerplate_stats()
+    pages = _prefetch(iter_clean_pages(data_dir, pdf_files=to_index, stats=boilerplate_stats))
+    dedup_filter = None
+    if DEDUP_THRESHOLD > 0:
+        dedup_filter = NearDuplicateFilter()
+        if manifest:
+            # chunks of unchanged files; those of re-indexed and removed files are rewritten
+            dedup_filter.load(build_path, exclude_sources={p.name for p in to_index}
+                              | {name for name in manifest["files"] if name not in hashes})
+    chunks = iter_chunks(pages, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                         dedup_filter=dedup_filter, chunk_unit=CHUNK_UNIT)
+    ids_by_source = {}
+    chunks = _skip_committed(chunks, committed, ids_by_source)
+    batches = _prefetch(_batched(chunks, BATCH_SIZE))
+    embedded = _prefetch(_embed_batches(batches, doc_embeddings))
+
+    # stores that only persist on save() are checkpointed when saved
+    total = 0
+    unsaved_ids = []
+    try:
+        for num_batches, (batch, vectors) in enumerate(embedded, 1):
+            print(f"Processing {total + 1}-{total + len(batch)}...")
+            _write_batch(db, batch, vectors)
+            if token_store is not None:
+                # reranker input, so queries only tokenize the query
+                token_store.add([get_chunk_id(c) for c in batch],
+                                passage_tokenizer.encode([c.text for c in batch]))
+            unsaved_ids.extend(get_chunk_id(c) for c in batch)
+            total += len(batch)
+
+            if db.durable or num_batches % SAVE_EVERY == 0:
+                db.save()
+                _record_checkpoint(build_path, unsaved_ids)
+                unsaved_ids = []
+    finally:
+        # on a failed write, stop the pipeline and its parse workers now,
+        # downstream first so no stage is running when it is closed
+        for stage in (embedded, batches, pages):
+            stage.close()
+
+    print(format_boilerplate_stats(boilerplate_stats))
+
+    links = {}
+    if dedup_filter is not None:
+        _write_dedup_updates(db, dedup_filter)
+        links = dedup_filter.links
+        print(f"Dropped {dedup_filter.dropped} near-duplicate chunks")
+
+    files = {}
+    if manifest and manifest.get("chunking") == _chunking_params():
+        files = {name: entry for name, entry in manifest["files"].items()
+                 if name in hashes}
+
+    for pdf_path in to_index:
+        # files that failed to load are left out so the next run retries them
+        # (a file whose chunks all duplicate other files' has links instead)
+        if pdf_path.name in ids_by_source or links.get(pdf_path.name):
+            files[pdf_path.name] = {
+                "sha256": hashes[pdf_path.name],
+                "chunk_ids": ids_by_source.get(pdf_path.name, []),
+                "linked": sorted(links.get(pdf_path.name, ())),
+            }
         else:
-            db.add_documents(documents=batch_chunks, ids=batch_ids)
+            files.pop(pdf_path.name, None)
+
+    # unchanged files that new files duplicate are linked to them as well
+    for name, entry in files.items():
+        if links.get(name):
+            entry["linked"] = sorted(set(entry.get("linked", [])) | links[name])
+
+    db.save()
+    if token_store is not None:
+        token_store.close()
+    discard_other_stores(build_path)
+    if dedup_filter is not None:
+        dedup_filter.save(build_path)
+    elif os.path.exists(os.path.join(build_path, SIGNATURES_FILE)):
+        os.remove(os.path.join(build_path, SIGNATURES_FILE))
+    save_manifest(build_path, {"chunking": _chunking_params(), "files": files})
+    clear_checkpoint(build_path)
+    publish_build(chroma_path, build_path)
+    print(f"Published index version {os.path.basename(build_path)}")
+
+    if isinstance(doc_embeddings, CachedEmbeddings):
+        print(f"Embedding cache: {doc_embeddings.hits} hits, "
+              f"{doc_embeddings.misses} embedded")
+    if api_embeddings is not None:
+        print(f"Embedding API: {api_embeddings.requests} requests, "
+              f"{api_embeddings.tokens} tokens, {api_embeddings.rate_limited} rate limited")
 
     elapsed = time.time() - start_time
     mins = int(elapsed // 60)
@@ -87,4 +530,17 @@ def index_documents(reset=False):
 
 
 if __name__ == "__main__":
-    index_documents(reset=True)
+    parser = argparse.ArgumentParser(
+        description="Index the PDFs in data/documents into the vector database."
+    )
+    parser.add_argument(
+        "--reset", action="store_true",
+        help="rebuild the database from scratch instead of updating it",
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="continue an interrupted build from its last written batch",
+    )
+    args = parser.parse_args()
+
+    index_documents(reset=args.reset, resume=args.resume)
@@ -1,35 +1,195 @@
+import os
+import re
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from langchain_community.document_loaders import PyPDFLoader
+from dotenv import load_dotenv
+from pypdf import PdfReader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from .dedup import NearDuplicateFilter, DEDUP_THRESHOLD
+from .page_cache import PageCache, PAGE_CACHE_DIR
+from .records import Page, Chunk, to_documents
+from .tokens import TOKEN_ENCODING, count_tokens, count_tokens_batch, get_encoding
 
-def load_pdfs(data_dir="data/documents"):
-    documents = []
+load_dotenv()
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+PAGE_RANGE_SIZE = int(os.getenv("INGEST_PAGE_RANGE", "100"))
+# a line near the top or bottom of a page is boilerplate if it repeats on at
+# least this share of the document's pages (and on BOILERPLATE_MIN_PAGES)
+BOILERPLATE_MIN_RATIO = float(os.getenv("BOILERPLATE_MIN_RATIO", "0.5"))
+BOILERPLATE_MIN_PAGES = 3
+BOILERPLATE_EDGE_LINES = 4
+# units of chunk_size/chunk_overlap: "chars", or "tokens" of the embedding
+# model's tokenizer
+CHUNK_UNITS = ("chars", "tokens")
+# token-sized chunks keep embedding and prompt budgets predictable
+CHUNK_UNIT = os.getenv("CHUNK_UNIT", "chars")
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1500" if CHUNK_UNIT == "chars" else "350"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100" if CHUNK_UNIT == "chars" else "25"))
+SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+
+
+def _load_pdf(pdf_path, start=0, end=None):
+    """
+    Load pages [start, end) of a PDF into Page records.
+    Safe to run in a worker process; errors are returned, not raised.
+    """
+    try:
+        reader = PdfReader(str(pdf_path))
+        if end is None:
+            end = len(reader.pages)
+
+        docs = []
+        for page_number in range(start, end):
+            text = reader.pages[page_number].extract_text()
+            docs.append(Page(pdf_path.name, page_number, text))
+    except Exception as e:
+        return [], str(e)
+
+    return docs, None
+
+
+def _count_pages(pdf_path):
+    try:
+        return len(PdfReader(str(pdf_path)).pages)
+    except Exception:
+        # let the worker hit (and report) the same error
+        return None
+
+
+def _plan_tasks(pdf_files, page_range_size):
+    """
+    Split each PDF into (path, start, end) page ranges so one very large
+    file is spread over several workers instead of holding up the pool.
+    """
+    tasks = []
+    for pdf_path in pdf_files:
+        num_pages = _count_pages(pdf_path)
+
+        if num_pages is None or num_pages <= page_range_size:
+            tasks.append((pdf_path, 0, None))
+            continue
+
+        for start in range(0, num_pages, page_range_size):
+            tasks.append((pdf_path, start, min(start + page_range_size, num_pages)))
+
+    return tasks
+
+
+def find_pdfs(data_dir):
     data_path = Path(data_dir)
 
     if not data_path.exists():
         raise FileNotFoundError(f"Directory not found: {data_dir}")
 
-    pdf_files = list(data_path.glob("*.pdf"))
+    pdf_files = sorted(data_path.glob("*.pdf"))
 
     if not pdf_files:
         raise ValueError(f"No PDF files found in {data_dir}")
 
-    print(f"Found {len(pdf_files)} PDF files")
+    return pdf_files
 
-    for pdf_path in pdf_files:
-        print(f"Loading: {pdf_path.name}")
-        try:
-            loader = PyPDFLoader(str(pdf_path))
-            docs = loader.load()
 
-            for doc in docs:
-                doc.metadata["source"] = pdf_path.name
+def _map_bounded(executor, tasks, window):
+    """Like executor.map, but keeps at most `window` tasks in flight."""
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(_load_pdf, *task))
+
+    while pending:
+        yield pending.popleft().result()
+
 
-            documents.extend(docs)
-        except Exception as e:
-            print(f"Error loading {pdf_path.name}: {e}")
+def _merge_by_file(tasks, results):
+    """
+    Group page-range results back into one page list per file. Tasks are in
+    file order then page order, so merging is a concatenation; a file is
+    skipped entirely if any of its ranges failed.
+    """
+    current, docs, error = None, [], None
+
+    for (pdf_path, _, _), (range_docs, range_error) in zip(tasks, results):
+        if pdf_path != current:
+            if current is not None:
+                yield current, docs, error
+            current, docs, error = pdf_path, [], None
+
+        docs.extend(range_docs)
+        if error is None:
+            error = range_error
+
+    if current is not None:
+        yield current, docs, error
+
+
+def _skip_failed(merged):
+    for pdf_path, docs, error in merged:
+        if error is not None:
+            print(f"Error loading {pdf_path.name}: {error}")
             continue
+        yield pdf_path, docs
+
+
+def _iter_loaded(pdf_files, workers, page_range_size):
+    """Yield (pdf_path, pages) for each file that loaded, in name order."""
+    def load_sequential():
+        for pdf_path in pdf_files:
+            print(f"Loading: {pdf_path.name}")
+            yield _load_pdf(pdf_path)
+
+    if workers > 1:
+        tasks = _plan_tasks(pdf_files, page_range_size)
+        print(f"Loading {len(tasks)} page ranges with {workers} worker processes")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = _map_bounded(executor, tasks, window=workers * 2)
+            merged = _merge_by_file(tasks, results)
+            yield from _skip_failed(merged)
+    else:
+        tasks = [(pdf_path, 0, None) for pdf_path in pdf_files]
+        merged = _merge_by_file(tasks, load_sequential())
+        yield from _skip_failed(merged)
+
+
+def iter_pdfs(data_dir="data/documents", workers=None, page_range_size=None,
+              pdf_files=None):
+    """
+    Yield the Page records of each PDF in data_dir, one file at a time.
+
+    workers: number of processes used to parse PDFs in parallel
+    (defaults to INGEST_WORKERS).
+    page_range_size: in parallel mode, PDFs longer than this many pages are
+    split into ranges and parsed by several workers (defaults to
+    INGEST_PAGE_RANGE).
+    pdf_files: only load these files instead of every PDF in data_dir.
+
+    Files are always yielded in name order and pages in page order, so
+    the output is the same whatever the worker count. Only a bounded
+    number of page ranges is parsed ahead of the consumer.
+    """
+    if pdf_files is None:
+        pdf_files = find_pdfs(data_dir)
+
+    if workers is None:
+        workers = INGEST_WORKERS
+    if page_range_size is None:
+        page_range_size = PAGE_RANGE_SIZE
+
+    print(f"Found {len(pdf_files)} PDF files")
+
+    for _, docs in _iter_loaded(pdf_files, workers, page_range_size):
+        yield docs
+
+
+def load_pdfs(data_dir="data/documents", workers=None, page_range_size=None):
+    """Load every PDF in data_dir into a single list of Page records."""
+    documents = []
+
+    for docs in iter_pdfs(data_dir, workers=workers, page_range_size=page_range_size):
+        documents.extend(docs)
 
     print(f"Loaded {len(documents)} pages total")
     return documents
@@ -43,49 +203,298 @@ def clean_text(text):
     return text.strip()
 
 
-def chunk_documents(documents, chunk_size=1500, chunk_overlap=100):
-    for doc in documents:
-        doc.page_content = clean_text(doc.page_content)
+def _make_splitter(chunk_size, chunk_overlap, chunk_unit="chars"):
+    if chunk_unit not in CHUNK_UNITS:
+        raise ValueError(f"chunk_unit must be one of {CHUNK_UNITS}, got {chunk_unit!r}")
 
-    documents = [doc for doc in documents if doc.page_content.strip()]
+    if chunk_unit == "tokens" and get_encoding() is not None:
+        return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name=TOKEN_ENCODING,
+            disallowed_special=(),
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=SEPARATORS,
+        )
 
-    splitter = RecursiveCharacterTextSplitter(
+    # without the tokenizer's data, tokens are estimated like count_tokens does
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
-        length_function=len,
-        separators=["\n\n", "\n", ". ", " ", ""]
+        length_function=count_tokens if chunk_unit == "tokens" else len,
+        separators=SEPARATORS,
     )
 
-    all_chunks = []
+
+def _boilerplate_key(line):
+    # page numbers and years vary between otherwise identical lines
+    return re.sub(r"\d+", "#", " ".join(line.split()).lower())
+
+
+def _edge_lines(lines):
+    edge = BOILERPLATE_EDGE_LINES
+    return lines[:edge] + lines[max(edge, len(lines) - edge):]
+
+
+def new_boilerplate_stats():
+    return {"lines": 0, "chars": 0, "tokens": 0}
+
+
+def strip_boilerplate(documents, stats=None):
+    """
+    Remove running headers, footers, copyright lines and page numbers:
+    lines near the top or bottom of a page whose text (ignoring digits)
+    repeats on many pages of the same PDF. Works in place on raw page text,
+    before clean_text joins lines. Adds what was removed to stats.
+    """
+    by_source = {}
     for doc in documents:
-        page_chunks = splitter.split_documents([doc])
-        all_chunks.extend(page_chunks)
+        by_source.setdefault(doc.source, []).append(doc)
 
-    source_chunk_counters = {}
-    for chunk in all_chunks:
-        source = chunk.metadata.get("source", "unknown")
+    for pages in by_source.values():
+        min_pages = max(BOILERPLATE_MIN_PAGES, BOILERPLATE_MIN_RATIO * len(pages))
+        if len(pages) < min_pages:
+            continue
+
+        page_lines = [
+            [line for line in doc.text.splitlines() if line.strip()]
+            for doc in pages
+        ]
 
-        if source not in source_chunk_counters:
-            source_chunk_counters[source] = 0
+        counts = Counter()
+        for lines in page_lines:
+            counts.update({_boilerplate_key(line) for line in _edge_lines(lines)})
+        boilerplate = {key for key, n in counts.items() if n >= min_pages}
+        if not boilerplate:
+            continue
+
+        for doc, lines in zip(pages, page_lines):
+            edge = BOILERPLATE_EDGE_LINES
+            kept, removed = [], []
+            for i, line in enumerate(lines):
+                at_edge = i < edge or i >= len(lines) - edge
+                if at_edge and _boilerplate_key(line) in boilerplate:
+                    removed.append(line)
+                else:
+                    kept.append(line)
+
+            if removed:
+                doc.text = "\n".join(kept)
+                if stats is not None:
+                    stats["lines"] += len(removed)
+                    stats["chars"] += sum(len(line) for line in removed)
+                    stats["tokens"] += count_tokens("\n".join(removed))
+
+    return documents
+
+
+def clean_documents(documents, stats=None):
+    """
+    Strip repeated headers/footers, clean page text in place and drop pages
+    left empty. stats, if given, accumulates what boilerplate removal saved.
+    """
+    strip_boilerplate(documents, stats)
+
+    for doc in documents:
+        doc.text = clean_text(doc.text)
+
+    return [doc for doc in documents if doc.text.strip()]
+
+
+def _cleaning_params():
+    return {
+        "boilerplate_min_ratio": BOILERPLATE_MIN_RATIO,
+        "boilerplate_min_pages": BOILERPLATE_MIN_PAGES,
+        "boilerplate_edge_lines": BOILERPLATE_EDGE_LINES,
+    }
+
+
+def _add_stats(stats, other):
+    if stats is not None:
+        for key in stats:
+            stats[key] += other.get(key, 0)
+
+
+def iter_clean_pages(data_dir="data/documents", workers=None, page_range_size=None,
+                     pdf_files=None, stats=None, cache_dir=None):
+    """
+    Yield the cleaned pages of each PDF in data_dir, one file at a time,
+    in name order.
+
+    Cleaned pages are kept in the page cache (PAGE_CACHE_DIR, keyed by
+    file hash and cleaning parameters), so PDFs that did not change since
+    an earlier run are not parsed again. An empty cache_dir disables the
+    cache. The other arguments are as for iter_pdfs; stats accumulates
+    boilerplate removal, including what was saved on cached files.
+    """
+    if pdf_files is None:
+        pdf_files = find_pdfs(data_dir)
+    if workers is None:
+        workers = INGEST_WORKERS
+    if page_range_size is None:
+        page_range_size = PAGE_RANGE_SIZE
+    if cache_dir is None:
+        cache_dir = PAGE_CACHE_DIR
+
+    print(f"Found {len(pdf_files)} PDF files")
+
+    if not cache_dir:
+        for _, docs in _iter_loaded(pdf_files, workers, page_range_size):
+            yield clean_documents(docs, stats)
+        return
+
+    cache = PageCache(_cleaning_params(), cache_dir)
+    to_parse = [p for p in pdf_files if not cache.contains(p)]
+    print(f"Page cache: {len(pdf_files) - len(to_parse)} files cached, "
+          f"{len(to_parse)} to parse")
+
+    def clean_and_store(pdf_path, docs):
+        file_stats = new_boilerplate_stats()
+        docs = clean_documents(docs, file_stats)
+        cache.put(pdf_path, docs, file_stats)
+        _add_stats(stats, file_stats)
+        return docs
+
+    # misses are parsed in the background of the same ordered walk, so
+    # output order does not depend on which files were cached
+    parsed = _iter_loaded(to_parse, workers, page_range_size)
+    pending = next(parsed, None)
+    to_parse = set(to_parse)
+
+    for pdf_path in pdf_files:
+        if pdf_path in to_parse:
+            if pending is not None and pending[0] == pdf_path:
+                yield clean_and_store(*pending)
+                pending = next(parsed, None)
+            continue  # failed to load, already reported
+
+        cached = cache.get(pdf_path)
+        if cached is None:
+            docs, error = _load_pdf(pdf_path)
+            if error is not None:
+                print(f"Error loading {pdf_path.name}: {error}")
+                continue
+            yield clean_and_store(pdf_path, docs)
+            continue
 
-        chunk.metadata["chunk_id"] = source_chunk_counters[source]
-        source_chunk_counters[source] += 1
+        docs, file_stats = cached
+        _add_stats(stats, file_stats)
+        yield docs
 
-    print(f"Created {len(all_chunks)} chunks from {len(documents)} pages")
+
+def load_clean_pages(data_dir="data/documents", workers=None, stats=None, cache_dir=None):
+    """Load the cleaned pages of every PDF in data_dir, through the page cache."""
+    documents = []
+
+    for docs in iter_clean_pages(data_dir, workers=workers, stats=stats, cache_dir=cache_dir):
+        documents.extend(docs)
+
+    print(f"Loaded {len(documents)} cleaned pages total")
+    return documents
+
+
+def _split_documents(documents, splitter, source_chunk_counters):
+    # one split call per group of pages (a file when streaming); chunks
+    # never span pages, and each remembers its page by position
+    split = splitter.create_documents(
+        [doc.text for doc in documents],
+        metadatas=[{"page": i} for i in range(len(documents))],
+    )
+    pages = [documents[piece.metadata["page"]] for piece in split]
+    texts = [piece.page_content for piece in split]
+    token_counts = count_tokens_batch(texts)
+
+    all_chunks = []
+    for doc, text, token_count in zip(pages, texts, token_counts):
+        chunk_id = source_chunk_counters.get(doc.source, 0)
+        all_chunks.append(Chunk(doc.source, doc.page, chunk_id, text, token_count))
+        source_chunk_counters[doc.source] = chunk_id + 1
+
+    return all_chunks
+
+
+def split_documents(documents, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                    chunk_unit=CHUNK_UNIT):
+    """
+    Split cleaned pages into Chunk records numbered per source. chunk_size
+    and chunk_overlap are counted in chunk_unit ("chars" or "tokens";
+    defaults from CHUNK_SIZE, CHUNK_OVERLAP and CHUNK_UNIT); every chunk's
+    token count is stored in its "token_count" metadata.
+    """
+    splitter = _make_splitter(chunk_size, chunk_overlap, chunk_unit)
+    return _split_documents(documents, splitter, {})
+
+
+def chunk_documents(documents, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                    dedup_threshold=DEDUP_THRESHOLD, cleaned=False, stats=None,
+                    chunk_unit=CHUNK_UNIT):
+    """
+    Clean and split pages into chunks, then drop near-duplicate chunks
+    (e.g. sections shared by an annual report and a 10-K). The kept copy
+    records where else its text appears in its "also_in" metadata.
+    dedup_threshold=0 keeps every chunk. Returns Chunk records.
+
+    cleaned: the pages are already cleaned (e.g. from load_clean_pages);
+    stats then holds what boilerplate removal saved, for the summary.
+    """
+    if stats is None:
+        stats = new_boilerplate_stats()
+    if not cleaned:
+        documents = clean_documents(documents, stats)
+    all_chunks = split_documents(documents, chunk_size, chunk_overlap, chunk_unit)
+
+    num_split = len(all_chunks)
+    if dedup_threshold > 0:
+        dedup_filter = NearDuplicateFilter(threshold=dedup_threshold)
+        all_chunks = list(dedup_filter.filter(all_chunks))
+        for chunk in all_chunks:
+            chunk.also_in = dedup_filter.updated.get(chunk.id, chunk.also_in)
+
+    tokens = sum(chunk.token_count for chunk in all_chunks)
+    print(f"Created {len(all_chunks)} chunks ({tokens} tokens) from {len(documents)} pages "
+          f"({num_split - len(all_chunks)} near-duplicates dropped)")
+    print(format_boilerplate_stats(stats))
     return all_chunks
 
 
-def run_ingestion(data_dir="data/documents"):
+def format_boilerplate_stats(stats):
+    return (f"Stripped {stats['lines']} boilerplate lines: "
+            f"{stats['chars']} characters, {stats['tokens']} tokens saved")
+
+
+def iter_chunks(page_groups, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                dedup_filter=None, chunk_unit=CHUNK_UNIT):
+    """
+    Streaming counterpart of chunk_documents: takes an iterable of cleaned
+    page lists (e.g. from iter_clean_pages) and yields Chunk records as each group
+    is split, so only one file's pages need to be in memory at a time.
+
+    dedup_filter: optional NearDuplicateFilter. Its "also_in" updates can
+    reach chunks that were already yielded, so the caller must write
+    dedup_filter.updated (by chunk ID) once the stream is exhausted.
+    chunk_unit: as for split_documents.
+    """
+    splitter = _make_splitter(chunk_size, chunk_overlap, chunk_unit)
+    source_chunk_counters = {}
+
+    for documents in page_groups:
+        chunks = _split_documents(documents, splitter, source_chunk_counters)
+        if dedup_filter is not None:
+            chunks = dedup_filter.filter(chunks)
+        yield from chunks
+
+
+def run_ingestion(data_dir="data/documents", workers=None):
     print("Starting ingestion...")
     print("=" * 50)
 
-    documents = load_pdfs(data_dir)
-    chunks = chunk_documents(documents)
+    stats = new_boilerplate_stats()
+    documents = load_clean_pages(data_dir, workers=workers, stats=stats)
+    chunks = chunk_documents(documents, cleaned=True, stats=stats)
 
     print("=" * 50)
     print(f"Ingestion complete: {len(chunks)} chunks ready")
 
-    return chunks
+    return to_documents(chunks)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+
+from .rerank_tokens import model_max_length, pair_inputs, tokenize_queries
+
+# where exported models are kept, one subdirectory per model
+ONNX_RERANKER_DIR = os.getenv("ONNX_RERANKER_DIR", ".cache/onnx_reranker")
+# inference threads per session; 0 lets ONNX Runtime use every core
+ONNX_RERANKER_THREADS = int(os.getenv("ONNX_RERANKER_THREADS", "0"))
+MODEL_FILE = "model.int8.onnx"
+INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+def model_dir(model_name, base_dir=ONNX_RERANKER_DIR):
+    return os.path.join(base_dir, model_name.replace("/", "--"))
+
+
+def export_model(model_name, base_dir=ONNX_RERANKER_DIR):
+    """
+    Export a Hugging Face cross-encoder to ONNX and quantize its weights
+    to int8 (dynamic quantization: activations are quantized per batch
+    at run time). Needs torch, transformers and onnx, which serving hosts
+    running the exported model do not.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    out_dir = model_dir(model_name, base_dir)
+    tmp_dir = f"{out_dir}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+    sample = tokenizer(["query"], ["passage"], return_tensors="pt")
+    input_names = [name for name in INPUT_NAMES if name in sample]
+
+    fp32_path = os.path.join(tmp_dir, "model.onnx")
+    torch.onnx.export(
+        model, tuple(sample[name] for name in input_names), fp32_path,
+        input_names=input_names, output_names=["logits"],
+        dynamic_axes={name: {0: "batch", 1: "sequence"} for name in input_names},
+        opset_version=17, dynamo=False,
+    )
+    quantize_dynamic(fp32_path, os.path.join(tmp_dir, MODEL_FILE), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    # tokenizer.json (fast tokenizer) and config.json are all the runtime reads
+    tokenizer.save_pretrained(tmp_dir)
+    model.config.save_pretrained(tmp_dir)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return out_dir
+
+
+class OnnxCrossEncoder:
+    """
+    Drop-in for sentence_transformers.CrossEncoder.predict on an exported
+    int8 ONNX model, run with ONNX Runtime on the CPU. Only onnxruntime
+    and tokenizers are imported, not torch. Tokenization (truncation to
+    the model's max length) and the output activation follow
+    CrossEncoder, so scores match it up to quantization error.
+
+    The model must have been exported into ONNX_RERANKER_DIR beforehand
+    (`python -m rag.onnx_reranker export`), since exporting needs torch.
+    """
+
+    def __init__(self, model_name, base_dir=ONNX_RERANKER_DIR, threads=ONNX_RERANKER_THREADS):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        path = model_dir(model_name, base_dir)
+        if not os.path.exists(os.path.join(path, MODEL_FILE)):
+            raise FileNotFoundError(
+                f"No ONNX export of {model_name} in {path}. Export it on a host with torch "
+                f"and onnx (python -m rag.onnx_reranker export --model {model_name} "
+                f"--dir {base_dir}) and copy the directory here."
+            )
+
+        with open(os.path.join(path, "config.json"), encoding="utf-8") as f:
+            config = json.load(f)
+        with open(os.path.join(path, "tokenizer_config.json"), encoding="utf-8") as f:
+            tokenizer_config = json.load(f)
+        self.max_length = model_max_length(tokenizer_config.get("model_max_length"),
+                                           config.get("max_position_embeddings", 512))
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_length, strategy="longest_first")
+        self.pad_id = config.get("pad_token_id") or 0
+        self.tokenizer.enable_padding(pad_id=self.pad_id,
+                                      pad_token=tokenizer_config.get("pad_token", "[PAD]"))
+        self.cls_id = self.tokenizer.token_to_id(tokenizer_config.get("cls_token", "[CLS]"))
+        self.sep_id = self.tokenizer.token_to_id(tokenizer_config.get("sep_token", "[SEP]"))
+
+        # as in CrossEncoder: the activation named in the config, else a
+        # sigmoid for single-label models (ms-marco models name Identity)
+        activation = config.get("sbert_ce_default_activation_function")
+        num_labels = len(config.get("id2label") or {0: "LABEL_0"})
+        self.sigmoid = activation.endswith("Sigmoid") if activation else num_labels == 1
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(path, MODEL_FILE), options, providers=["CPUExecutionProvider"],
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    @staticmethod
+    def _inputs(encodings):
+        return {
+            "input_ids": np.asarray([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.asarray([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.asarray([e.type_ids for e in encodings], dtype=np.int64),
+        }
+
+    def _scores(self, batches):
+        scores = []
+        for inputs in batches:
+            inputs = {name: inputs[name] for name in self.input_names}
+            logits = self.session.run(["logits"], inputs)[0]
+            scores.append(logits[:, 0] if logits.shape[1] == 1 else logits)
+
+        if not scores:
+            return np.empty(0, dtype=np.float32)
+        scores = np.concatenate(scores).astype(np.float32)
+        return 1.0 / (1.0 + np.exp(-scores)) if self.sigmoid else scores
+
+    def predict(self, pairs, batch_size=32, **kwargs):
+        """Scores of (query, passage) pairs, as CrossEncoder.predict returns them."""
+        return self._scores(
+            self._inputs(self.tokenizer.encode_batch(
+                [(query.strip(), passage.strip()) for query, passage in pairs[start:start + batch_size]]
+            ))
+            for start in range(0, len(pairs), batch_size)
+        )
+
+    def predict_tokenized(self, pairs, batch_size=32):
+        """Scores of (query, pre-tokenized passage) pairs (see rag.rerank_tokens)."""
+        pairs = tokenize_queries(
+            lambda query: self.tokenizer.encode(query, add_special_tokens=False).ids, pairs,
+        )
+        return self._scores(
+            pair_inputs(pairs[start:start + batch_size],
+                        self.cls_id, self.sep_id, self.pad_id, self.max_length)
+            for start in range(0, len(pairs), batch_size)
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the reranker to an int8 ONNX model.")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--model", default="cross-encoder/ms-marco-MiniLM-L-6-v2")
+    parser.add_argument("--dir", default=ONNX_RERANKER_DIR)
+    args = parser.parse_args()
+
+    print(f"Exported to {export_model(args.model, args.dir)}")
@@ -0,0 +1,145 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import time
+from .records import Page
+
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", ".cache/pages")
+# bump when parsing or cleaning changes in a way the parameters do not capture
+PAGE_CACHE_VERSION = 1
+
+_hash_memo = {}
+
+
+def file_hash(path):
+    """sha256 of a file's content, memoized per (path, size, mtime) within a process."""
+    stat = os.stat(path)
+    memo_key = (os.fspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key in _hash_memo:
+        return _hash_memo[memo_key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    _hash_memo[memo_key] = digest.hexdigest()
+    return _hash_memo[memo_key]
+
+
+class PageCache:
+    """
+    On-disk store of cleaned page text, one gzipped JSON file per PDF,
+    keyed by the PDF's content hash and the cleaning parameters.
+
+    Re-running ingestion or chunking experiments on unchanged PDFs reads
+    the cleaned pages back instead of parsing the PDFs again. Pages are
+    stored with their page numbers; the source name is taken from the
+    file being loaded, so a renamed copy of a PDF is still a hit.
+    """
+
+    def __init__(self, params, cache_dir=PAGE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+        key_data = json.dumps({"version": PAGE_CACHE_VERSION, **params}, sort_keys=True)
+        self.params_key = hashlib.sha256(key_data.encode("utf-8")).hexdigest()[:12]
+
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, pdf_path):
+        return os.path.join(self.cache_dir, f"{file_hash(pdf_path)}-{self.params_key}.json.gz")
+
+    def contains(self, pdf_path):
+        return os.path.exists(self._path(pdf_path))
+
+    def get(self, pdf_path):
+        """
+        Return (pages, boilerplate_stats) for a cached PDF, or None. A
+        missing or unreadable entry counts as a miss.
+        """
+        path = self._path(pdf_path)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        os.utime(path)  # last use, for pruning
+        pages = [Page(pdf_path.name, page, text) for page, text in record["pages"]]
+        return pages, record["boilerplate"]
+
+    def put(self, pdf_path, pages, boilerplate_stats):
+        path = self._path(pdf_path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        record = {
+            "source": pdf_path.name,
+            "pages": [[page.page, page.text] for page in pages],
+            "boilerplate": boilerplate_stats,
+        }
+
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def _entries(cache_dir):
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".json.gz"):
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return sorted(entries)
+
+
+def prune(cache_dir=PAGE_CACHE_DIR, max_bytes=None, max_age_days=None):
+    """Delete entries unused for max_age_days, then the least recently used
+    ones until the cache fits in max_bytes. Returns the number removed."""
+    entries = _entries(cache_dir)
+    removed = 0
+
+    if max_age_days is not None:
+        cutoff = time.time() - max_age_days * 86400
+        for mtime, _, path in entries:
+            if mtime < cutoff:
+                os.remove(path)
+                removed += 1
+        entries = [e for e in entries if e[0] >= cutoff]
+
+    if max_bytes is not None:
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or prune the parsed-page cache.")
+    parser.add_argument("--dir", default=PAGE_CACHE_DIR, help="cache directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="show the number and size of cached PDFs")
+    prune_parser = commands.add_parser("prune", help="remove old or excess entries")
+    prune_parser.add_argument("--max-mb", type=float, help="keep the cache under this size")
+    prune_parser.add_argument("--max-age-days", type=float, help="drop entries unused for this long")
+    args = parser.parse_args()
+
+    if args.command == "prune":
+        max_bytes = int(args.max_mb * 1024 * 1024) if args.max_mb is not None else None
+        removed = prune(args.dir, max_bytes=max_bytes, max_age_days=args.max_age_days)
+        print(f"Removed {removed} entries")
+
+    entries = _entries(args.dir)
+    print(f"{len(entries)} cached PDFs, {sum(size for _, size, _ in entries) / (1024 * 1024):.1f} MB")
@@ -2,7 +2,10 @@ import re
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 
-from .retrieval import retrieve_context, format_retrieved_context
+from .retrieval import (
+    retrieve_context, format_retrieved_context, current_index_version, get_query_embeddings,
+)
+from .answer_cache import AnswerCache, ANSWER_CACHE_SIZE
 
 load_dotenv()
 
@@ -78,11 +81,13 @@ def process_citations(answer, all_citations):
 
     source_pages = {}
     for c in used_citations:
-        src = c.get("source", "Unknown")
-        page = c.get("page", 1)
-        if src not in source_pages:
-            source_pages[src] = set()
-        source_pages[src].add(page)
+        # a deduplicated chunk cites every place its text appears
+        for loc in [c] + c.get("also_in", []):
+            src = loc.get("source", "Unknown")
+            page = loc.get("page", 1)
+            if src not in source_pages:
+                source_pages[src] = set()
+            source_pages[src].add(page)
 
     sources = []
     for src, pages in source_pages.items():
@@ -157,11 +162,38 @@ def expand_query(question, chat_history):
     return question
 
 
+_answer_cache = AnswerCache() if ANSWER_CACHE_SIZE > 0 else None
+
+
+def get_answer_cache():
+    return _answer_cache
+
+
+def _cached_answer(question, k):
+    """Return (cached result or None, question embedding or None, index version)."""
+    version = current_index_version()
+    result = _answer_cache.get(question, k, version)
+    if result is not None:
+        return result, None, version
+
+    vector = None
+    if _answer_cache.semantic:
+        # the same (cached) query embedding retrieval uses
+        vector = get_query_embeddings().embed_query(question)
+    return _answer_cache.get_similar(vector, k, version), vector, version
+
+
 def ask(question, k=5, chat_history=None):
     """
     Main function to answer a question.
 
     chat_history: optional list of previous messages for conversation context
+
+    Answers to questions asked without chat history are cached (see
+    AnswerCache), so the same or a paraphrased question is answered
+    without retrieval or an LLM call until the index changes. With
+    history, the earlier turns shape the answer, so it is neither served
+    from nor stored in the cache.
     """
     if has_injection(question):
         return {
@@ -175,6 +207,13 @@ def ask(question, k=5, chat_history=None):
 
     # fetch more docs for "go on" / "elaborate" type requests
     elaboration = re.search(r"^(go on|continue|elaborate|tell me more|more\b)", question.lower().strip())
+
+    # the last turns go into the prompt, so such an answer belongs to one conversation
+    cacheable = _answer_cache is not None and not chat_history and not elaboration
+    if cacheable:
+        cached, question_vector, index_version = _cached_answer(question, k)
+        if cached is not None:
+            return cached
     results = retrieve_context(search_query, k=k + 3 if elaboration else k)
     if not results:
         return {"answer": IDK_FALLBACK, "sources": [], "citations": [], "num_sources": 0}
@@ -186,12 +225,15 @@ def ask(question, k=5, chat_history=None):
     answer = generate_answer(question, context, chat_history)
     answer, sources, used_citations = process_citations(answer, all_citations)
 
-    return {
+    result = {
         "answer": answer,
         "sources": sources,
         "citations": used_citations,
         "num_sources": len(sources),
     }
+    if cacheable:
+        _answer_cache.put(question, k, index_version, result, question_vector)
+    return result
 
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+from langchain_core.documents import Document
+
+
+class Page:
+    """Text of one PDF page (page numbers are 0-based)."""
+
+    __slots__ = ("source", "page", "text")
+
+    def __init__(self, source, page, text):
+        self.source = source
+        self.page = page
+        self.text = text
+
+    def __repr__(self):
+        return f"Page({self.source!r}, {self.page}, {len(self.text)} chars)"
+
+
+class Chunk:
+    """
+    A chunk of page text with the fields the index stores as metadata.
+
+    Ingestion passes these slotted records around instead of LangChain
+    Documents, which carry a metadata dict (and more) per object; the
+    metadata dict is only built when a chunk is written to the vector
+    store or handed out as a Document.
+    """
+
+    __slots__ = ("source", "page", "chunk_id", "text", "token_count", "also_in")
+
+    def __init__(self, source, page, chunk_id, text, token_count, also_in=""):
+        self.source = source
+        self.page = page
+        self.chunk_id = chunk_id
+        self.text = text
+        self.token_count = token_count
+        # "file.pdf:12|other.pdf:3", see NearDuplicateFilter
+        self.also_in = also_in
+
+    def __repr__(self):
+        return f"Chunk({self.source!r}, {self.page}, {self.chunk_id}, {self.token_count} tokens)"
+
+    @property
+    def id(self):
+        """The chunk's ID in the vector store."""
+        return f"{self.source}:p{self.page}:c{self.chunk_id}"
+
+    @property
+    def metadata(self):
+        """A new metadata dict, as stored in the vector store."""
+        metadata = {
+            "source": self.source,
+            "page": self.page,
+            "chunk_id": self.chunk_id,
+            "token_count": self.token_count,
+        }
+        if self.also_in:
+            metadata["also_in"] = self.also_in
+        return metadata
+
+    def to_document(self):
+        return Document(page_content=self.text, metadata=self.metadata)
+
+
+def to_documents(chunks):
+    return [chunk.to_document() for chunk in chunks]
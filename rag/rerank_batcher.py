@@ -0,0 +1,200 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import numpy as np
+
+from .rerank_tokens import predict_tokenized
+
+# "0" lets every request run the reranker on its own thread
+RERANK_BATCHING = os.getenv("RERANK_BATCHING", "1") == "1"
+# most pairs scored in one forward pass
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "64"))
+# longest a request waits (milliseconds) for others to share its forward pass
+RERANK_BATCH_WAIT_MS = float(os.getenv("RERANK_BATCH_WAIT_MS", "5"))
+# longest a request waits (seconds) for the worker to start on it before
+# the caller scores its pairs itself
+RERANK_BATCH_TIMEOUT = float(os.getenv("RERANK_BATCH_TIMEOUT", "30"))
+
+
+class _Request:
+    __slots__ = ("kind", "pairs", "future", "submitted")
+
+    def __init__(self, kind, pairs):
+        self.kind = kind
+        self.pairs = pairs
+        self.future = Future()
+        self.submitted = time.monotonic()
+
+
+class RerankBatcher:
+    """
+    One worker thread that runs the reranker for all requests: pairs
+    submitted by concurrent callers within max_wait_ms of the oldest
+    waiting one are scored in a single forward pass of up to
+    max_batch_size pairs, and each caller gets its own scores back.
+
+    The wait is counted from submission, so a request never waits longer
+    than max_wait_ms for company, and it is skipped while requests arrive
+    further apart than that on average (a lone caller pays nothing);
+    requests that queued while the model was busy go into the next pass
+    either way. Requests are served in arrival order, and one larger than
+    max_batch_size runs on its own.
+
+    predict() and predict_tokenized() block like the rerankers' methods.
+    Pre-tokenized and text pairs of a batch run as two passes. If a pass
+    fails, its requests are retried one at a time, so only the one that
+    caused the error gets it. A caller whose request the worker has not
+    started within timeout seconds (or whose worker stopped) scores its
+    pairs on its own thread instead.
+    """
+
+    def __init__(self, reranker, max_batch_size=RERANK_BATCH_SIZE,
+                 max_wait_ms=RERANK_BATCH_WAIT_MS, timeout=RERANK_BATCH_TIMEOUT):
+        self.reranker = reranker
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.timeout = timeout
+
+        self._queue = queue.Queue()
+        self._held = None  # taken from the queue but did not fit in the last batch
+        self._last_arrival = None
+        self._arrival_gap = None  # moving average of the time between requests
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.pairs = 0
+        self.fallbacks = 0  # requests the caller scored itself
+
+        self._worker = threading.Thread(target=self._run, name="rerank-batcher", daemon=True)
+        self._worker.start()
+
+    def predict(self, pairs, batch_size=None, **kwargs):
+        """Scores of (query, passage text) pairs."""
+        return self._submit("text", pairs)
+
+    def predict_tokenized(self, pairs, batch_size=None):
+        """Scores of (query, pre-tokenized passage) pairs (see rag.rerank_tokens)."""
+        return self._submit("tokenized", pairs)
+
+    def _submit(self, kind, pairs):
+        if not pairs:
+            return np.empty(0, dtype=np.float32)
+        request = _Request(kind, list(pairs))
+        with self._lock:
+            if self._last_arrival is not None:
+                gap = request.submitted - self._last_arrival
+                self._arrival_gap = gap if self._arrival_gap is None else \
+                    0.8 * self._arrival_gap + 0.2 * gap
+            self._last_arrival = request.submitted
+        self._queue.put(request)
+
+        deadline = request.submitted + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                return request.future.result(timeout=min(1.0, remaining) if remaining > 0 else 1.0)
+            except FutureTimeoutError:
+                pass
+            if not self._worker.is_alive():
+                if request.future.cancel():
+                    break
+                raise RuntimeError("The rerank worker stopped")
+            # a pass that already started on the request is waited for
+            if time.monotonic() >= deadline and request.future.cancel():
+                break
+
+        with self._lock:
+            self.fallbacks += 1
+        return np.asarray(self._score(kind, request.pairs))
+
+    def _next_batch(self):
+        """The next requests to score together; may be empty if all were cancelled."""
+        first = self._held or self._queue.get()
+        self._held = None
+        batch, size = [first], len(first.pairs)
+        # waiting only pays off if another request is likely to arrive in time
+        busy = self._arrival_gap is not None and self._arrival_gap <= self.max_wait
+        deadline = first.submitted + (self.max_wait if busy else 0)
+
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if size + len(request.pairs) > self.max_batch_size:
+                self._held = request
+                break
+            batch.append(request)
+            size += len(request.pairs)
+        # callers that gave up waiting have cancelled theirs
+        return [request for request in batch if request.future.set_running_or_notify_cancel()]
+
+    def _score(self, kind, pairs):
+        if kind == "tokenized":
+            return predict_tokenized(self.reranker, pairs, batch_size=self.max_batch_size)
+        return self.reranker.predict(pairs, batch_size=self.max_batch_size)
+
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                batch = self._next_batch()
+                self._serve(batch)
+            except Exception as e:
+                # keep the worker alive; only the requests not answered yet fail
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _serve(self, batch):
+        with self._lock:
+            self.requests += len(batch)
+            self.pairs += sum(len(request.pairs) for request in batch)
+
+        for kind in ("tokenized", "text"):
+            requests = [request for request in batch if request.kind == kind]
+            if not requests:
+                continue
+            with self._lock:
+                self.batches += 1
+
+            try:
+                scores = np.asarray(self._score(
+                    kind, [pair for request in requests for pair in request.pairs]
+                ))
+            except Exception as e:
+                if len(requests) == 1:
+                    requests[0].future.set_exception(e)
+                else:
+                    self._retry_each(kind, requests)
+                continue
+
+            start = 0
+            for request in requests:
+                request.future.set_result(scores[start:start + len(request.pairs)])
+                start += len(request.pairs)
+
+    def _retry_each(self, kind, requests):
+        """Score the requests of a failed pass one by one, so only the bad ones fail."""
+        for request in requests:
+            with self._lock:
+                self.batches += 1
+            try:
+                request.future.set_result(np.asarray(self._score(kind, request.pairs)))
+            except Exception as e:
+                request.future.set_exception(e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "pairs": self.pairs,
+                "pairs_per_batch": round(self.pairs / self.batches, 1) if self.batches else 0.0,
+                "requests_per_batch": round(self.requests / self.batches, 2) if self.batches else 0.0,
+                "fallbacks": self.fallbacks,
+            }
@@ -0,0 +1,76 @@
+import os
+import threading
+from collections import OrderedDict
+
+from .answer_cache import normalize_question
+
+# cross-encoder scores kept, one per (query, chunk) pair; 0 disables the cache
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+
+
+class RerankScoreCache:
+    """
+    LRU cache of cross-encoder scores keyed by the normalized query and
+    the chunk ID, so pairs already scored (a repeated question, or a
+    follow-up expanded into the same query) skip CrossEncoder.predict.
+
+    The ms-marco MiniLM cross-encoder lowercases its input, so scores do
+    not change with the case and spacing the key normalizes away. Chunk
+    IDs are only stable within an index version: all entries are dropped
+    when the version changes.
+    """
+
+    def __init__(self, max_size=RERANK_CACHE_SIZE):
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._scores = OrderedDict()  # (normalized query, chunk ID) -> score
+        self._index_version = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, query, chunk_ids, index_version):
+        """Cached scores for these chunks, None where a pair was not scored yet."""
+        query = normalize_question(query)
+        scores = []
+
+        with self._lock:
+            if index_version != self._index_version:
+                self._scores.clear()
+                self._index_version = index_version
+
+            for chunk_id in chunk_ids:
+                key = (query, chunk_id)
+                score = self._scores.get(key) if chunk_id is not None else None
+                if score is None:
+                    self.misses += 1
+                else:
+                    self._scores.move_to_end(key)
+                    self.hits += 1
+                scores.append(score)
+        return scores
+
+    def put_many(self, query, chunk_ids, scores, index_version):
+        query = normalize_question(query)
+
+        with self._lock:
+            if index_version != self._index_version:
+                return
+            for chunk_id, score in zip(chunk_ids, scores):
+                if chunk_id is None:
+                    continue
+                self._scores[(query, chunk_id)] = float(score)
+                self._scores.move_to_end((query, chunk_id))
+            while len(self._scores) > self.max_size:
+                self._scores.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._scores),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,95 @@
+import os
+import threading
+
+# "1" lets the vector distances skip or shrink reranking; off until the
+# thresholds are tuned on labelled queries (benchmarks.rerank_cascade)
+RERANK_CASCADE = os.getenv("RERANK_CASCADE", "0") == "1"
+# this many candidates or fewer (left after RELEVANCE_THRESHOLD) keep their vector order
+CASCADE_FEW_CANDIDATES = int(os.getenv("CASCADE_FEW_CANDIDATES", "2"))
+# distance gap between the nearest and the second nearest chunk that skips reranking; 0 disables it
+CASCADE_MARGIN = float(os.getenv("CASCADE_MARGIN", "0.2"))
+# only candidates within this distance of the nearest one are reranked; 0 reranks all
+CASCADE_WINDOW = float(os.getenv("CASCADE_WINDOW", "0.4"))
+
+
+class RerankCascade:
+    """
+    Decides from the vector distances how much of a candidate list the
+    cross-encoder has to score:
+
+    - skip: at most few_candidates candidates, or the nearest one is
+      ahead of the second by at least margin (a decisive winner); the
+      vector order is kept.
+    - shrink: only the candidates within window of the nearest one are
+      reranked; the rest follow them in vector order.
+    - rerank: every candidate is scored.
+
+    Distances are the store's (squared L2, lower is nearer). The defaults
+    are starting points; tune them on labelled queries with
+    benchmarks.rerank_cascade.
+    """
+
+    def __init__(self, few_candidates=CASCADE_FEW_CANDIDATES, margin=CASCADE_MARGIN,
+                 window=CASCADE_WINDOW):
+        self.few_candidates = few_candidates
+        self.margin = margin
+        self.window = window
+
+        self._lock = threading.Lock()
+        self.actions = {"skip": 0, "shrink": 0, "rerank": 0}
+        self.pairs_scored = 0
+        self.pairs_skipped = 0
+
+    def thresholds(self):
+        return {"few_candidates": self.few_candidates, "margin": self.margin,
+                "window": self.window}
+
+    def plan(self, distances):
+        """
+        How many of the candidates to rerank, and the decision report.
+
+        distances: the candidates' vector distances in vector order (as
+        search returns them). The candidates to rerank are always the
+        first ones.
+        """
+        num = len(distances)
+        gap = distances[1] - distances[0] if num > 1 else None
+
+        if num <= self.few_candidates:
+            action, reason, num_rerank = "skip", "few_candidates", 0
+        elif self.margin > 0 and gap is not None and gap >= self.margin:
+            action, reason, num_rerank = "skip", "margin", 0
+        else:
+            num_rerank = num
+            if self.window > 0:
+                num_rerank = sum(d <= distances[0] + self.window for d in distances)
+            if num_rerank <= 1:
+                action, reason, num_rerank = "skip", "window", 0
+            elif num_rerank < num:
+                action, reason = "shrink", "window"
+            else:
+                action, reason = "rerank", None
+
+        with self._lock:
+            self.actions[action] += 1
+            self.pairs_scored += num_rerank
+            self.pairs_skipped += num - num_rerank
+
+        return num_rerank, {
+            "action": action,
+            "reason": reason,
+            "candidates": num,
+            "reranked": num_rerank,
+            "margin": None if gap is None else round(float(gap), 4),
+            "thresholds": self.thresholds(),
+        }
+
+    def stats(self):
+        with self._lock:
+            pairs = self.pairs_scored + self.pairs_skipped
+            return {
+                **self.actions,
+                "pairs_scored": self.pairs_scored,
+                "pairs_skipped": self.pairs_skipped,
+                "skipped_rate": round(self.pairs_skipped / pairs, 3) if pairs else 0.0,
+            }
@@ -0,0 +1,225 @@
+import os
+import sqlite3
+import threading
+import numpy as np
+
+# store each chunk's reranker token IDs at index time ("0" disables it)
+RERANK_PRETOKENIZE = os.getenv("RERANK_PRETOKENIZE", "1") == "1"
+TOKENS_FILE = "rerank_tokens.sqlite3"
+# special tokens around a (query, passage) pair: [CLS] query [SEP] passage [SEP]
+NUM_SPECIAL_TOKENS = 3
+
+
+class RerankTokenStore:
+    """
+    Side store of an index version: the reranker's token IDs of each
+    chunk's text, without special tokens and truncated to what fits in a
+    pair with the shortest query, keyed by chunk ID, with the untruncated
+    length that pair truncation depends on. IDs are stored as uint16 when
+    the vocabulary allows it (2 bytes per token).
+
+    Only valid for the reranker model it was written with (self.model).
+    """
+
+    def __init__(self, index_path, model=None, vocab_size=None):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(index_path, TOKENS_FILE),
+                                     check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS tokens (
+                chunk_id TEXT PRIMARY KEY,
+                length INTEGER NOT NULL,
+                ids BLOB NOT NULL
+            );
+        """)
+
+        meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        if model is not None and meta.get("model") != model:
+            # a new model invalidates every stored passage
+            dtype = "uint16" if vocab_size is not None and vocab_size <= 65536 else "uint32"
+            with self._conn:
+                self._conn.execute("DELETE FROM tokens")
+                self._conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                       [("model", model), ("dtype", dtype)])
+            meta = {"model": model, "dtype": dtype}
+
+        self.model = meta.get("model")
+        self.dtype = np.dtype(meta.get("dtype", "uint32"))
+
+    @staticmethod
+    def exists(index_path):
+        return os.path.exists(os.path.join(index_path, TOKENS_FILE))
+
+    def add(self, chunk_ids, passages):
+        """passages: (token IDs, untruncated length) per chunk, see PassageTokenizer."""
+        rows = [(chunk_id, length, np.asarray(ids, dtype=self.dtype).tobytes())
+                for chunk_id, (ids, length) in zip(chunk_ids, passages)]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)", rows)
+
+    def delete(self, chunk_ids):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM tokens WHERE chunk_id = ?",
+                                   [(chunk_id,) for chunk_id in chunk_ids])
+
+    def get_many(self, chunk_ids):
+        """(token IDs as an int64 array, untruncated length) per chunk, None where not stored."""
+        wanted = [chunk_id for chunk_id in set(chunk_ids) if chunk_id is not None]
+        found = {}
+        with self._lock:
+            # stay below SQLite's limit on bound parameters
+            for i in range(0, len(wanted), 500):
+                part = wanted[i:i + 500]
+                for chunk_id, length, ids in self._conn.execute(
+                    f"SELECT chunk_id, length, ids FROM tokens "
+                    f"WHERE chunk_id IN ({','.join('?' * len(part))})",
+                    part,
+                ):
+                    found[chunk_id] = (np.frombuffer(ids, dtype=self.dtype).astype(np.int64), length)
+        return [found.get(chunk_id) for chunk_id in chunk_ids]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tokens").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+class PassageTokenizer:
+    """
+    Tokenizes chunk texts at index time the way the reranker's tokenizer
+    does inside a pair: stripped, without special tokens, and cut to the
+    longest passage a pair can hold. Needs transformers (the reranker's
+    Hugging Face tokenizer).
+
+    local_files_only: only load a tokenizer already in the Hugging Face
+    cache (raises OSError otherwise).
+
+    Raises ValueError for tokenizers whose pairs are not built as
+    pair_inputs builds them ([CLS] query [SEP] passage [SEP], BERT style).
+    """
+
+    def __init__(self, model_name, local_files_only=False):
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        # the cached copy first: offline, a download only fails after a minute
+        # of retries (set HF_HUB_OFFLINE=1 to not try at all)
+        try:
+            self.tokenizer = AutoTokenizer.from_pretrained(model_name, local_files_only=True)
+        except OSError:
+            if local_files_only:
+                raise
+            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.vocab_size = len(self.tokenizer)
+        self.max_length = model_max_length(self.tokenizer.model_max_length)
+
+        query, passage = "capital requirements", "banks must hold capital"
+        expected = self.tokenizer([query], [passage], return_tensors="np")
+        query_ids = self.tokenizer(query, add_special_tokens=False)["input_ids"]
+        built = pair_inputs([(query_ids, self.encode([passage])[0])],
+                            self.tokenizer.cls_token_id, self.tokenizer.sep_token_id,
+                            self.tokenizer.pad_token_id, self.max_length)
+        if any(not np.array_equal(built[name], expected[name]) for name in expected):
+            raise ValueError(f"{model_name} does not build BERT-style pairs")
+
+    def encode(self, texts):
+        """(token IDs, untruncated length) of each text."""
+        # at least one query token shares the pair with the passage
+        limit = self.max_length - NUM_SPECIAL_TOKENS - 1
+        return [(ids[:limit], len(ids)) for ids in self.tokenizer(
+            [text.strip() for text in texts], add_special_tokens=False, verbose=False,
+        )["input_ids"]]
+
+
+def model_max_length(tokenizer_max_length, position_embeddings=512):
+    # tokenizers without a limit report a huge model_max_length
+    return min(tokenizer_max_length or position_embeddings, position_embeddings)
+
+
+def _truncate_pair(n_query, n_passage, budget):
+    """Lengths kept by "longest_first" truncation, as the tokenizers library computes them."""
+    if n_query + n_passage <= budget:
+        return n_query, n_passage
+
+    short, long = sorted((n_query, n_passage))
+    long = short if short > budget else max(short, budget - short)
+    if short + long > budget:
+        short = budget // 2
+        long = short + budget % 2
+    kept = (short, long) if n_query <= n_passage else (long, short)
+    return min(kept[0], n_query), min(kept[1], n_passage)
+
+
+def pair_inputs(pairs, cls_id, sep_id, pad_id, max_length):
+    """
+    input_ids, attention_mask and token_type_ids (int64, padded to the
+    longest pair) for [CLS] query [SEP] passage [SEP] of each pair, as
+    the tokenizer builds them from text.
+
+    pairs: (query token IDs, passage) pairs, where a passage is (token
+    IDs, untruncated length) as stored.
+    """
+    budget = max_length - NUM_SPECIAL_TOKENS
+    sequences, type_ids = [], []
+    for query_ids, (passage, length) in pairs:
+        n_query, n_passage = _truncate_pair(len(query_ids), length, budget)
+        first = [cls_id, *query_ids[:n_query], sep_id]
+        second = [*passage[:n_passage], sep_id]
+        sequences.append(first + second)
+        type_ids.append([0] * len(first) + [1] * len(second))
+
+    width = max(len(ids) for ids in sequences)
+    input_ids = np.full((len(sequences), width), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((len(sequences), width), dtype=np.int64)
+    token_type_ids = np.zeros((len(sequences), width), dtype=np.int64)
+    for row, (ids, types) in enumerate(zip(sequences, type_ids)):
+        input_ids[row, :len(ids)] = ids
+        attention_mask[row, :len(ids)] = 1
+        token_type_ids[row, :len(ids)] = types
+    return {"input_ids": input_ids, "attention_mask": attention_mask,
+            "token_type_ids": token_type_ids}
+
+
+def tokenize_queries(encode, pairs):
+    """pairs with each query replaced by its token IDs, encoding each distinct query once."""
+    query_ids = {}
+    for query, _ in pairs:
+        if query not in query_ids:
+            query_ids[query] = encode(query.strip())
+    return [(query_ids[query], passage) for query, passage in pairs]
+
+
+def predict_tokenized(reranker, pairs, batch_size=32):
+    """
+    Cross-encoder scores of (query, pre-tokenized passage) pairs; only
+    the queries are tokenized. Works with both reranker backends.
+    """
+    if hasattr(reranker, "predict_tokenized"):
+        return reranker.predict_tokenized(pairs, batch_size)
+
+    # sentence-transformers CrossEncoder
+    import torch
+
+    tokenizer = reranker.tokenizer
+    pairs = tokenize_queries(
+        lambda query: tokenizer(query, add_special_tokens=False)["input_ids"], pairs,
+    )
+    max_length = reranker.max_length or model_max_length(tokenizer.model_max_length)
+
+    scores = []
+    reranker.model.eval()
+    with torch.no_grad():
+        for start in range(0, len(pairs), batch_size):
+            inputs = pair_inputs(pairs[start:start + batch_size], tokenizer.cls_token_id,
+                                 tokenizer.sep_token_id, tokenizer.pad_token_id, max_length)
+            features = {name: torch.from_numpy(values).to(reranker.model.device)
+                        for name, values in inputs.items()}
+            logits = reranker.default_activation_function(reranker.model(**features).logits)
+            scores.append(logits[:, 0] if logits.shape[1] == 1 else logits)
+    return torch.cat(scores).float().cpu().numpy() if scores else np.empty(0, dtype=np.float32)
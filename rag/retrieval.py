@@ -1,17 +1,32 @@
 import os
 import re
+import threading
+from contextlib import contextmanager
+import time
 import zipfile
 import urllib.request
 from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-from sentence_transformers import CrossEncoder
+
+from .versions import current_index_path
+from .dedup import parse_also_in
+from .embedding_cache import CachedQueryEmbeddings
+from .rerank_batcher import RerankBatcher, RERANK_BATCHING
+from .rerank_cache import RerankScoreCache, RERANK_CACHE_SIZE
+from .rerank_cascade import RerankCascade, RERANK_CASCADE
+from .rerank_tokens import RerankTokenStore, predict_tokenized
+from .vector_store import open_store, needs_chroma_import, import_chroma_version
 
 load_dotenv()
 
 CHROMA_PATH = "chroma_db"
-COLLECTION_NAME = "rag_docs"
+EMBEDDING_MODEL = "text-embedding-3-small"
 RELEVANCE_THRESHOLD = 1.5
+RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# "torch" (sentence-transformers CrossEncoder) or "onnx" (int8 ONNX Runtime, see rag.onnx_reranker)
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "torch")
+# how often (seconds) to check whether a new index version was published
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "10"))
 
 GDRIVE_FILE_ID = "1i10PzY9uhHwYtTBaXCsT_EQ61U3FbNrs"
 
@@ -61,70 +76,304 @@ def is_safe_content(text):
     return not any(re.search(p, text, flags=re.IGNORECASE) for p in UNSAFE_PATTERNS)
 
 
-_cached_db = None
+_current_index = None
+_last_version_check = 0.0
+_db_lock = threading.Lock()
 _cached_reranker = None
+_rerank_batcher = None
+_reranker_lock = threading.Lock()
+_rerank_cache = RerankScoreCache() if RERANK_CACHE_SIZE > 0 else None
+_rerank_cascade = RerankCascade() if RERANK_CASCADE else None
+_query_embeddings = None
+
+
+def get_query_embeddings():
+    """
+    The query embeddings model, with an LRU cache of query vectors that
+    outlives index reloads. Its stats() report hits and misses.
+    """
+    global _query_embeddings
+
+    with _db_lock:
+        if _query_embeddings is None:
+            _query_embeddings = CachedQueryEmbeddings(
+                OpenAIEmbeddings(model=EMBEDDING_MODEL), model=EMBEDDING_MODEL
+            )
+    return _query_embeddings
+
+
+class _OpenIndex:
+    """
+    An index version opened for serving: its VectorStore, its reranker
+    token IDs (None if the build stored none for RERANKER_MODEL) and its
+    path, which versions the caches. Closed once a newer version replaced
+    it and no query uses it any more.
+    """
+
+    def __init__(self, path, db, tokens):
+        self.path = path
+        self.db = db
+        self.tokens = tokens
+        self.users = 0
+        self.retired = False
+
+    def close(self):
+        self.db.close()
+        if self.tokens is not None:
+            self.tokens.close()
+
+
+def _open_index(index_path, embeddings):
+    tokens = None
+    if RerankTokenStore.exists(index_path):
+        tokens = RerankTokenStore(index_path)
+        if tokens.model != RERANKER_MODEL:
+            tokens.close()
+            tokens = None
+    return _OpenIndex(index_path, open_store(index_path, embeddings), tokens)
+
+
+def _get_index(acquire=False):
+    global _current_index, _last_version_check
+
+    embeddings = get_query_embeddings()
+    retired = None
+
+    with _db_lock:
+        now = time.monotonic()
+        if _current_index is None or now - _last_version_check >= INDEX_RELOAD_INTERVAL:
+            _last_version_check = now
+
+            if not os.path.exists(CHROMA_PATH) or not os.listdir(CHROMA_PATH):
+                download_chroma_db()
+
+            index_path = current_index_path(CHROMA_PATH)
+            if needs_chroma_import(index_path):
+                index_path = import_chroma_version(CHROMA_PATH)
+            if _current_index is None or index_path != _current_index.path:
+                if _current_index is not None:
+                    print(f"Index version changed, loading {index_path}")
+                    _current_index.retired = True
+                    if _current_index.users == 0:
+                        retired = _current_index
+                _current_index = _open_index(index_path, embeddings)
+
+        index = _current_index
+        if acquire:
+            index.users += 1
+
+    if retired is not None:
+        retired.close()
+    return index
+
+
+def _release_index(index):
+    with _db_lock:
+        index.users -= 1
+        close = index.retired and index.users == 0
+    if close:
+        index.close()
 
 
 def get_vector_db():
-    global _cached_db
+    """
+    Return the VectorStore (selected by VECTOR_BACKEND) of the current
+    index version.
+
+    Every INDEX_RELOAD_INTERVAL seconds the published version is checked;
+    if a rebuild swapped it, the new version is opened and the previous
+    one is closed as soon as no query started with index_in_use() runs on
+    it. Use index_in_use() for queries; this is for warming up.
+    """
+    return _get_index().db
+
+
+@contextmanager
+def index_in_use():
+    """
+    (db, tokens, version) of the current index version: the store, the
+    reranker token IDs the build stored (or None) and the version path.
+    The version is kept open until the block exits even if a reload
+    replaces it meanwhile, so a query searches and reranks against the
+    same version.
+    """
+    index = _get_index(acquire=True)
+    try:
+        yield index.db, index.tokens, index.path
+    finally:
+        _release_index(index)
 
-    if _cached_db is None:
-        if not os.path.exists(CHROMA_PATH) or not os.listdir(CHROMA_PATH):
-            download_chroma_db()
 
-        embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-        _cached_db = Chroma(
-            collection_name=COLLECTION_NAME,
-            persist_directory=CHROMA_PATH,
-            embedding_function=embeddings
-        )
+def current_index_version():
+    """Path of the index version get_vector_db() currently serves."""
+    return _get_index().path
+
 
-    return _cached_db
+def load_reranker(backend=None, model_name=None):
+    """A new cross-encoder (RERANKER_MODEL by default); both backends have the same predict()."""
+    backend = backend or RERANKER_BACKEND
+    model_name = model_name or RERANKER_MODEL
+    # imported here so the ONNX backend never loads torch
+    if backend == "onnx":
+        from .onnx_reranker import OnnxCrossEncoder
+        return OnnxCrossEncoder(model_name)
+    if backend == "torch":
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(model_name)
+    raise ValueError(f"Unknown reranker backend {backend!r}, expected 'torch' or 'onnx'")
 
 
 def get_reranker():
     global _cached_reranker
 
-    if _cached_reranker is None:
-        _cached_reranker = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
+    with _reranker_lock:
+        if _cached_reranker is None:
+            _cached_reranker = load_reranker()
 
     return _cached_reranker
 
 
-def rerank_results(query, docs_with_scores, top_k=5):
-    """Re-score documents using a cross-encoder for better relevance ranking."""
-    if not docs_with_scores:
-        return []
+def get_rerank_batcher():
+    """
+    The worker that scores the pairs of concurrent requests in shared
+    forward passes (None if RERANK_BATCHING is off); stats() reports the
+    batch sizes.
+    """
+    global _rerank_batcher
 
+    if not RERANK_BATCHING:
+        return None
     reranker = get_reranker()
+    with _reranker_lock:
+        if _rerank_batcher is None:
+            _rerank_batcher = RerankBatcher(reranker)
+    return _rerank_batcher
+
+
+def get_rerank_cache():
+    """The cache of cross-encoder scores (None if disabled); stats() reports its hit rate."""
+    return _rerank_cache
+
+
+def get_rerank_cascade():
+    """The cascade that skips or shrinks reranking (None if disabled); stats() counts its decisions."""
+    return _rerank_cascade
+
+
+def _predict(query, docs, tokens=None):
+    """
+    Cross-encoder scores of (query, doc) pairs. Chunks whose token IDs
+    were stored at index time (tokens, of the docs' index version) are
+    not tokenized again. With batching on, the pairs share a forward pass
+    with those of concurrent requests.
+    """
+    reranker = get_rerank_batcher() or get_reranker()
+    passages = tokens.get_many([doc.id for doc in docs]) if tokens else [None] * len(docs)
+
+    scores = [None] * len(docs)
+    tokenized = [i for i, passage in enumerate(passages) if passage is not None]
+    if tokenized:
+        predicted = predict_tokenized(reranker, [(query, passages[i]) for i in tokenized])
+        for i, score in zip(tokenized, predicted):
+            scores[i] = score
+
+    untokenized = [i for i, passage in enumerate(passages) if passage is None]
+    if untokenized:
+        predicted = reranker.predict([(query, docs[i].page_content) for i in untokenized])
+        for i, score in zip(untokenized, predicted):
+            scores[i] = score
+    return scores
+
+
+def _predict_cached(query, docs, tokens=None, version=None):
+    """
+    Cross-encoder scores of (query, doc) pairs, predicting only the
+    uncached ones. version is the docs' index version; without it the
+    cache is not used.
+    """
+    if _rerank_cache is None or version is None:
+        return _predict(query, docs, tokens)
+
+    chunk_ids = [doc.id for doc in docs]
+    scores = _rerank_cache.get_many(query, chunk_ids, version)
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        predicted = _predict(query, [docs[i] for i in missing], tokens)
+        for i, score in zip(missing, predicted):
+            scores[i] = score
+        _rerank_cache.put_many(query, [chunk_ids[i] for i in missing], predicted, version)
+    return scores
+
+
+def rerank_results(query, docs_with_scores, top_k=5, cascade=None, report=None,
+                   tokens=None, version=None):
+    """
+    Re-score documents using a cross-encoder for better relevance ranking.
+
+    tokens and version are those of the index version the documents come
+    from (see index_in_use()): stored token IDs are used for the chunks
+    that have them, and scores of pairs seen before on that version are
+    served from the rerank cache. With a
+    RerankCascade, only the candidates it selects are scored; the others
+    keep their vector order after them, with a score of None. report, if
+    given, receives the cascade's decision.
+    """
+    if not docs_with_scores:
+        return []
 
-    pairs = [(query, doc.page_content) for doc, _ in docs_with_scores]
+    num_rerank = len(docs_with_scores)
+    if cascade is not None:
+        num_rerank, decision = cascade.plan([score for _, score in docs_with_scores])
+        if report is not None:
+            report.update(decision)
 
-    rerank_scores = reranker.predict(pairs)
+    head = docs_with_scores[:num_rerank]
+    rerank_scores = _predict_cached(query, [doc for doc, _ in head], tokens, version) \
+        if head else []
 
-    reranked = list(zip(docs_with_scores, rerank_scores))
+    reranked = list(zip(head, rerank_scores))
     reranked.sort(key=lambda x: x[1], reverse=True)
 
     results = [(doc, float(rerank_score))
                for (doc, _), rerank_score in reranked[:top_k]]
+    results += [(doc, None) for doc, _ in docs_with_scores[num_rerank:]]
 
-    return results
+    return results[:top_k]
 
 
-def retrieve_context(query, k=5):
-    db = get_vector_db()
-
+def search_candidates(db, query, k=5):
+    """The k * 2 nearest chunks in db within RELEVANCE_THRESHOLD, without unsafe content."""
     initial_results = db.similarity_search_with_score(query, k=k * 2)
 
-    filtered = [
+    return [
         (doc, score) for doc, score in initial_results
         if score <= RELEVANCE_THRESHOLD and is_safe_content(doc.page_content)
     ]
 
-    if not filtered:
-        return []
 
-    reranked = rerank_results(query, filtered, top_k=k)
+def retrieve_context(query, k=5, report=None):
+    """
+    The k most relevant chunks as (doc, rerank score) pairs; the score is
+    None for chunks the rerank cascade left in vector order.
+
+    report: optional dict that receives the rerank cascade's decision for
+    this query (see RerankCascade.plan) and the search and rerank times.
+    """
+    with index_in_use() as (db, tokens, version):
+        start = time.perf_counter()
+        filtered = search_candidates(db, query, k)
+        searched = time.perf_counter()
+        if report is not None:
+            report["search_ms"] = round((searched - start) * 1000, 2)
+
+        if not filtered:
+            return []
+
+        reranked = rerank_results(query, filtered, top_k=k, cascade=_rerank_cascade,
+                                  report=report, tokens=tokens, version=version)
+
+    if report is not None:
+        report["rerank_ms"] = round((time.perf_counter() - searched) * 1000, 2)
 
     return reranked
 
@@ -148,14 +397,24 @@ def format_retrieved_context(results):
         source_doc = doc.metadata.get("source", "Unknown")
         page_num = doc.metadata.get("page", 0) + 1
 
-        context_parts.append(
-            f"[Source {source_num}: {source_doc}, Page {page_num}]\n{content}"
-        )
+        # near-duplicate copies of this text elsewhere in the corpus
+        also_in = [
+            {"source": src, "page": page + 1}
+            for src, page in parse_also_in(doc.metadata.get("also_in"))
+        ]
+
+        header = f"Source {source_num}: {source_doc}, Page {page_num}"
+        if also_in:
+            header += "; also in " + "; ".join(
+                f"{c['source']}, Page {c['page']}" for c in also_in
+            )
+        context_parts.append(f"[{header}]\n{content}")
 
         citations.append({
             "source": source_doc,
             "page": page_num,
-            "score": None if score is None else float(score)
+            "score": None if score is None else float(score),
+            "also_in": also_in,
         })
 
         source_num += 1
@@ -0,0 +1,35 @@
+import warnings
+from functools import lru_cache
+import tiktoken
+
+# tokenizer of text-embedding-3-small
+TOKEN_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    """
+    Load the tokenizer, or return None if its data cannot be fetched
+    (e.g. offline without a tiktoken cache), in which case token counts
+    fall back to an estimate of 4 characters per token.
+    """
+    try:
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        warnings.warn(f"tiktoken encoding unavailable ({e}), estimating token counts")
+        return None
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        return max(1, len(text) // 4) if text else 0
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_tokens_batch(texts):
+    """Token counts of many texts, encoded in parallel by tiktoken."""
+    encoding = get_encoding()
+    if encoding is None:
+        return [count_tokens(text) for text in texts]
+    return [len(ids) for ids in encoding.encode_batch(list(texts), disallowed_special=())]
@@ -0,0 +1,803 @@
+import json
+import os
+import shutil
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.vectorstores import Chroma
+
+from .versions import current_index_path, start_build, publish_build
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent imports are not serialized
+    fcntl = None
+
+try:
+    import hnswlib  # installed with chromadb (chroma-hnswlib)
+except ImportError:
+    hnswlib = None
+
+COLLECTION_NAME = "rag_docs"
+# which VectorStore holds and searches the index: "chroma", "numpy" (exact
+# in-process search), "int8" / "binary" (quantized in-process search) or
+# "hnsw" (approximate in-process search)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "100"))
+IMPORT_PAGE_SIZE = 5000
+# dimensions of the vectors searched in the first pass (experimental: the
+# full vectors are kept too, and recall on real embeddings is unmeasured);
+# 0 searches the full vectors
+SEARCH_DIM = int(os.getenv("SEARCH_DIM", "0"))
+# the first pass of a reduced-dimension search returns k * RESCORE_OVERSAMPLE
+# candidates, which are rescored with the full vectors
+RESCORE_OVERSAMPLE = int(os.getenv("RESCORE_OVERSAMPLE", "2"))
+# int8 and binary stores: also keep the float32 vectors to rescore exactly
+# (larger on disk than a numpy index), and how many candidates per result
+# the binary pass keeps
+QUANTIZED_KEEP_FLOAT = os.getenv("QUANTIZED_KEEP_FLOAT", "0") == "1"
+BINARY_OVERSAMPLE = int(os.getenv("BINARY_OVERSAMPLE", "40"))
+QUANTIZED_BLOCK_ROWS = 4096
+
+
+class VectorStore:
+    """
+    Interface of the vector index backends, one instance per index
+    directory (an index version).
+
+    Scores returned by search are distances (squared L2 unless a Chroma
+    collection was created with another space): lower is more similar,
+    as RELEVANCE_THRESHOLD expects. Returned Documents carry the entry ID.
+
+    durable: whether add/delete are persisted immediately; other stores
+    only persist on save().
+    """
+
+    name = None
+    durable = False
+
+    def __init__(self, index_path, embedding_function=None):
+        self.index_path = index_path
+        self.embedding_function = embedding_function
+
+    @classmethod
+    def exists(cls, index_path):
+        raise NotImplementedError
+
+    def add(self, ids, vectors, texts, metadatas):
+        """Insert or replace entries by ID."""
+        raise NotImplementedError
+
+    def update_metadata(self, ids, metadatas):
+        """Set the given metadata keys of existing entries, keeping the others."""
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def search(self, vector, k=4):
+        """Return the k nearest entries as [(Document, distance)], nearest first."""
+        raise NotImplementedError
+
+    def save(self):
+        pass
+
+    def close(self):
+        """Release what the store holds in memory; it must not be used afterwards."""
+
+    def similarity_search_with_score(self, query, k=4):
+        return self.search(self.embedding_function.embed_query(query), k)
+
+
+class ChromaStore(VectorStore):
+    name = "chroma"
+    durable = True
+
+    def __init__(self, index_path, embedding_function=None):
+        super().__init__(index_path, embedding_function)
+        self.db = Chroma(
+            collection_name=COLLECTION_NAME,
+            embedding_function=embedding_function,
+            persist_directory=index_path,
+        )
+
+    @classmethod
+    def exists(cls, index_path):
+        return os.path.exists(os.path.join(index_path, "chroma.sqlite3"))
+
+    @property
+    def space(self):
+        return (self.db._collection.metadata or {}).get("hnsw:space", "l2")
+
+    def add(self, ids, vectors, texts, metadatas):
+        self.db._collection.upsert(
+            ids=ids, embeddings=vectors, metadatas=metadatas, documents=texts,
+        )
+
+    def update_metadata(self, ids, metadatas):
+        self.db._collection.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids):
+        self.db.delete(ids=ids)
+
+    def count(self):
+        return self.db._collection.count()
+
+    def search(self, vector, k=4):
+        # queried directly rather than through LangChain, whose results drop the IDs
+        results = self.db._collection.query(
+            query_embeddings=[np.asarray(vector, dtype=np.float32)], n_results=k,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            (Document(id=id_, page_content=text, metadata=metadata or {}), distance)
+            for id_, text, metadata, distance in zip(
+                results["ids"][0], results["documents"][0],
+                results["metadatas"][0], results["distances"][0],
+            )
+        ]
+
+    def iter_items(self, page_size=IMPORT_PAGE_SIZE):
+        """Yield (ids, vectors, texts, metadatas) pages of the whole collection."""
+        for offset in range(0, self.count(), page_size):
+            page = self.db._collection.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=page_size, offset=offset,
+            )
+            yield page["ids"], page["embeddings"], page["documents"], page["metadatas"]
+
+    def close(self):
+        # chromadb caches one system per path for the life of the process,
+        # with the collection's index loaded; drop and stop this one
+        from chromadb.api.shared_system_client import SharedSystemClient
+
+        identifier = self.db._client._identifier
+        system = SharedSystemClient._identifier_to_system.pop(identifier, None)
+        if system is not None:
+            system.stop()
+
+
+def _replace_dir(tmp_dir, out_dir):
+    # the old directory is moved aside rather than deleted first, so it can
+    # be restored (see _restore_dir) if the process dies between the renames
+    old_dir = out_dir + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def _restore_dir(out_dir):
+    old_dir = out_dir + ".old"
+    if not os.path.exists(out_dir) and os.path.exists(old_dir):
+        os.replace(old_dir, out_dir)
+
+
+class _InProcessStore(VectorStore):
+    """
+    Base of the stores kept in memory and saved as files in a
+    subdirectory of the index version. An index version that only has a
+    Chroma collection (e.g. the downloaded database) is converted with
+    import_chroma_version(), which publishes the imported store as a new
+    version, so serving processes never write to the version they read.
+    """
+
+    subdir = None
+    import_chroma = True
+
+    def __init__(self, index_path, embedding_function=None):
+        super().__init__(index_path, embedding_function)
+        self.index_dir = os.path.join(index_path, self.subdir)
+        self.space = "l2"
+
+        _restore_dir(self.index_dir)
+        if os.path.exists(os.path.join(self.index_dir, "chunks.json")):
+            self._load()
+
+    @classmethod
+    def exists(cls, index_path):
+        index_dir = os.path.join(index_path, cls.subdir)
+        return (os.path.exists(os.path.join(index_dir, "chunks.json"))
+                or os.path.exists(os.path.join(index_dir + ".old", "chunks.json")))
+
+    def import_from(self, chroma):
+        """Add every entry of a ChromaStore and save."""
+        print(f"Importing the Chroma collection into {self.index_dir}...")
+        self.space = chroma.space
+        for page in chroma.iter_items():
+            self.add(*page)
+        self.save()
+
+    def _distances(self, products, norms, query_vector):
+        if self.space == "cosine":
+            return 1.0 - products / np.maximum(np.sqrt(norms) * np.linalg.norm(query_vector), 1e-12)
+        if self.space == "ip":
+            return 1.0 - products
+        return norms - 2.0 * products + query_vector @ query_vector
+
+    def _save_files(self, write_index, chunks):
+        tmp_dir = f"{self.index_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        write_index(tmp_dir)
+        with open(os.path.join(tmp_dir, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump({"space": self.space, **chunks}, f)
+        _replace_dir(tmp_dir, self.index_dir)
+
+    def _load_chunks(self):
+        with open(os.path.join(self.index_dir, "chunks.json"), encoding="utf-8") as f:
+            chunks = json.load(f)
+        self.space = chunks.pop("space")
+        return chunks
+
+
+class NumpyStore(_InProcessStore):
+    """
+    Exact search over a contiguous float32 matrix: one matrix-vector
+    product per query and np.argpartition for the top k. Saved as
+    vectors.npy (memory-mapped when loaded), squared row norms and a JSON
+    file with the ids, texts and metadata of the rows.
+
+    Subclasses store other per-row arrays (see _encode); rows are kept
+    aligned across all of them.
+    """
+
+    name = "numpy"
+    subdir = "numpy_index"
+
+    def __init__(self, index_path, embedding_function=None):
+        self.ids, self.documents, self.metadatas = [], [], []
+        self._rows = {}
+        self._arrays = None  # name -> capacity x ... array; rows [0, size) are in use
+        self._size = 0
+        super().__init__(index_path, embedding_function)
+
+    def _encode(self, vectors):
+        """The per-row arrays stored for these vectors, by name."""
+        return {"vectors": vectors, "norms": np.einsum("ij,ij->i", vectors, vectors)}
+
+    def _load(self):
+        chunks = self._load_chunks()
+        self.ids = chunks["ids"]
+        self.documents = chunks["documents"]
+        self.metadatas = chunks["metadatas"]
+        self._rows = {id_: row for row, id_ in enumerate(self.ids)}
+        self._arrays = {
+            name: np.load(os.path.join(self.index_dir, f"{name}.npy"), mmap_mode="r")
+            for name in chunks.get("arrays", ["vectors", "norms"])
+        }
+        self._size = len(self.ids)
+
+    def _reserve(self, size, encoded=None):
+        if self._arrays is None:
+            self._arrays = {name: np.empty((0, *values.shape[1:]), dtype=values.dtype)
+                            for name, values in encoded.items()}
+
+        # loaded arrays are read-only memory maps; copy them on first write
+        current = next(iter(self._arrays.values()))
+        if size <= len(current) and not isinstance(current, np.memmap):
+            return
+        capacity = max(size, 2 * len(current), 1024)
+        for name, values in self._arrays.items():
+            grown = np.empty((capacity, *values.shape[1:]), dtype=values.dtype)
+            grown[:self._size] = values[:self._size]
+            self._arrays[name] = grown
+
+    def add(self, ids, vectors, texts, metadatas):
+        encoded = self._encode(np.asarray(vectors, dtype=np.float32))
+        rows = []
+        for id_ in ids:
+            row = self._rows.get(id_)
+            if row is None:
+                row = self._rows[id_] = len(self.ids)
+                self.ids.append(id_)
+                self.documents.append(None)
+                self.metadatas.append(None)
+            rows.append(row)
+
+        self._reserve(len(self.ids), encoded)
+        self._size = len(self.ids)
+        for name, values in encoded.items():
+            self._arrays[name][rows] = values
+        for row, text, metadata in zip(rows, texts, metadatas):
+            self.documents[row] = text
+            self.metadatas[row] = metadata
+
+    def update_metadata(self, ids, metadatas):
+        for id_, metadata in zip(ids, metadatas):
+            if id_ in self._rows:
+                row = self._rows[id_]
+                self.metadatas[row] = {**self.metadatas[row], **metadata}
+
+    def delete(self, ids):
+        ids = [id_ for id_ in ids if id_ in self._rows]
+        if not ids:
+            return
+        self._reserve(self._size)
+
+        # move the last row into each freed slot
+        for id_ in ids:
+            row = self._rows.pop(id_)
+            last = self._size - 1
+            if row != last:
+                for values in self._arrays.values():
+                    values[row] = values[last]
+                self.ids[row] = self.ids[last]
+                self.documents[row] = self.documents[last]
+                self.metadatas[row] = self.metadatas[last]
+                self._rows[self.ids[row]] = row
+            self.ids.pop()
+            self.documents.pop()
+            self.metadatas.pop()
+            self._size -= 1
+
+    def count(self):
+        return self._size
+
+    def vectors(self):
+        """The float32 vectors in row order, or None if only their codes are kept."""
+        if self._arrays is None or "vectors" not in self._arrays:
+            return None
+        return self._arrays["vectors"][:self._size]
+
+    def _exact_distances(self, rows, query_vector):
+        vectors, norms = self._arrays["vectors"], self._arrays["norms"]
+        if rows is None:
+            vectors, norms = vectors[:self._size], norms[:self._size]
+        else:
+            vectors, norms = vectors[rows], norms[rows]
+        return self._distances(vectors @ query_vector, norms, query_vector)
+
+    def _nearest(self, query_vector, k):
+        """(rows, distances) of the k nearest rows, nearest first."""
+        distances = self._exact_distances(None, query_vector)
+        top = _top_k(distances, k)
+        return top, distances[top]
+
+    def search(self, vector, k=4):
+        if self._size == 0:
+            return []
+
+        rows, distances = self._nearest(np.asarray(vector, dtype=np.float32), min(k, self._size))
+        return [
+            (Document(id=self.ids[i], page_content=self.documents[i],
+                      metadata=dict(self.metadatas[i] or {})),
+             float(distance))
+            for i, distance in zip(rows, distances)
+        ]
+
+    def _chunks_record(self):
+        return {"ids": self.ids, "documents": self.documents, "metadatas": self.metadatas,
+                "arrays": list(self._arrays)}
+
+    def save(self):
+        if self._arrays is None:
+            return
+
+        def write_index(tmp_dir):
+            for name, values in self._arrays.items():
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), values[:self._size])
+
+        self._save_files(write_index, self._chunks_record())
+
+
+def _top_k(distances, k):
+    """Indices of the k smallest distances, smallest first."""
+    k = min(k, len(distances))
+    top = np.argpartition(distances, k - 1)[:k]
+    return top[np.argsort(distances[top], kind="stable")]
+
+
+_M1, _M2, _M4, _H01 = (np.uint64(m) for m in (
+    0x5555555555555555, 0x3333333333333333, 0x0F0F0F0F0F0F0F0F, 0x0101010101010101,
+))
+
+
+def _popcount(words):
+    """Set bits per row of a uint64 matrix."""
+    if hasattr(np, "bitwise_count"):  # NumPy 2
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    words = words - ((words >> np.uint64(1)) & _M1)
+    words = (words & _M2) + ((words >> np.uint64(2)) & _M2)
+    words = (words + (words >> np.uint64(4))) & _M4
+    return ((words * _H01) >> np.uint64(56)).sum(axis=1, dtype=np.int64)
+
+
+class Int8Store(NumpyStore):
+    """
+    NumpyStore over vectors quantized to int8, about a quarter of the size:
+    each row is scaled by its largest absolute component to [-127, 127],
+    and its exact squared norm is kept. Distances are computed from the
+    float query and the codes, dequantized in blocks (an error well below
+    the spacing of relevance scores). With QUANTIZED_KEEP_FLOAT the
+    float32 vectors are kept as well, and the k * RESCORE_OVERSAMPLE
+    nearest rows by code are rescored exactly.
+    """
+
+    name = "int8"
+    subdir = "int8_index"
+
+    def __init__(self, index_path, embedding_function=None):
+        # a loaded index keeps the layout it was built with
+        self.keep_float = QUANTIZED_KEEP_FLOAT
+        super().__init__(index_path, embedding_function)
+
+    def _load(self):
+        super()._load()
+        self.keep_float = "vectors" in self._arrays
+
+    def _encode(self, vectors):
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        encoded = {
+            "codes": np.rint(vectors / scales[:, None]).astype(np.int8),
+            "scales": scales.astype(np.float32),
+            "norms": np.einsum("ij,ij->i", vectors, vectors),
+        }
+        if self.keep_float:
+            encoded["vectors"] = vectors
+        return encoded
+
+    def _code_distances(self, rows, query_vector):
+        codes, scales = self._arrays["codes"], self._arrays["scales"]
+        if rows is not None:
+            products = (codes[rows].astype(np.float32) @ query_vector) * scales[rows]
+            return self._distances(products, self._arrays["norms"][rows], query_vector)
+
+        # dequantize in blocks rather than materializing a float copy of the index
+        products = np.empty(self._size, dtype=np.float32)
+        for start in range(0, self._size, QUANTIZED_BLOCK_ROWS):
+            end = min(start + QUANTIZED_BLOCK_ROWS, self._size)
+            products[start:end] = codes[start:end].astype(np.float32) @ query_vector
+        products *= scales[:self._size]
+        return self._distances(products, self._arrays["norms"][:self._size], query_vector)
+
+    def _rescore(self, rows, query_vector):
+        if self.keep_float:
+            return self._exact_distances(rows, query_vector)
+        return self._code_distances(rows, query_vector)
+
+    def _nearest(self, query_vector, k):
+        distances = self._code_distances(None, query_vector)
+        if not self.keep_float:
+            top = _top_k(distances, k)
+            return top, distances[top]
+
+        shortlist = _top_k(distances, k * RESCORE_OVERSAMPLE)
+        distances = self._exact_distances(shortlist, query_vector)
+        top = _top_k(distances, k)
+        return shortlist[top], distances[top]
+
+
+class BinaryStore(Int8Store):
+    """
+    Int8Store with a first pass over one bit per dimension (the sign,
+    1/32 of the float32 size): the k * BINARY_OVERSAMPLE rows nearest by
+    Hamming distance are rescored from the int8 codes, or exactly with
+    QUANTIZED_KEEP_FLOAT. Only the bits are read for every query; the
+    codes are memory-mapped and touched for the shortlist alone. The bits
+    are stored on top of the int8 arrays, so the index is faster to
+    search than an Int8Store but slightly larger.
+    """
+
+    name = "binary"
+    subdir = "binary_index"
+
+    @staticmethod
+    def _sign_bits(vectors):
+        # padded to whole 64-bit words
+        padding = -vectors.shape[1] % 64
+        return np.packbits(np.pad(vectors > 0, ((0, 0), (0, padding))), axis=1)
+
+    def _encode(self, vectors):
+        return {"bits": self._sign_bits(vectors), **super()._encode(vectors)}
+
+    def _nearest(self, query_vector, k):
+        query_bits = self._sign_bits(query_vector[None])
+        bits = self._arrays["bits"][:self._size]
+        hamming = _popcount(np.ascontiguousarray(bits).view(np.uint64)
+                            ^ query_bits.view(np.uint64))
+
+        shortlist = _top_k(hamming, k * BINARY_OVERSAMPLE)
+        distances = self._rescore(shortlist, query_vector)
+        top = _top_k(distances, k)
+        return shortlist[top], distances[top]
+
+
+class FullVectorStore(NumpyStore):
+    """
+    Side store of the full-dimension vectors of an index searched with
+    truncated vectors (see TruncatedStore), keyed by chunk ID. Only the
+    vectors are kept; texts and metadata live in the searched store.
+    """
+
+    name = "full_vectors"
+    subdir = "full_vectors"
+    # the Chroma collection of a truncated index holds truncated vectors
+    import_chroma = False
+
+    def __init__(self, index_path, search_dim=0):
+        self.search_dim = search_dim
+        super().__init__(index_path)
+
+    def _load_chunks(self):
+        chunks = super()._load_chunks()
+        self.search_dim = chunks.pop("search_dim")
+        return chunks
+
+    def _chunks_record(self):
+        return {**super()._chunks_record(), "search_dim": self.search_dim}
+
+    def add(self, ids, vectors, texts=None, metadatas=None):
+        super().add(ids, vectors, [None] * len(ids), [None] * len(ids))
+
+    def distances(self, ids, vector):
+        """Full-dimension distances from vector to the entries with these IDs."""
+        rows = [self._rows[id_] for id_ in ids]
+        return self._exact_distances(rows, np.asarray(vector, dtype=np.float32))
+
+
+def truncate_vectors(vectors, dim):
+    """Keep the first dim components of each row and rescale it to unit length."""
+    vectors = np.asarray(vectors, dtype=np.float32)[..., :dim]
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class TruncatedStore(VectorStore):
+    """
+    Two-pass search with reduced-dimension vectors. The wrapped store
+    (any backend) holds the first search_dim components of each vector,
+    renormalized, so its index is smaller and faster to search; the full
+    vectors are kept in a FullVectorStore. search() takes the nearest
+    k * RESCORE_OVERSAMPLE entries by truncated vector and returns the k
+    nearest of those by full vector, with full-dimension distances, so
+    RELEVANCE_THRESHOLD keeps its meaning.
+
+    Experimental: the full vectors are stored as well, so the index is
+    larger on disk than without truncation, and the recall loss has only
+    been measured on synthetic vectors (see README).
+    """
+
+    def __init__(self, store, full_vectors):
+        super().__init__(store.index_path, store.embedding_function)
+        self.store = store
+        self.full_vectors = full_vectors
+        self.search_dim = full_vectors.search_dim
+        self.name = store.name
+        self.durable = False
+        if full_vectors.count() == 0:
+            full_vectors.space = getattr(store, "space", "l2")
+
+    @classmethod
+    def exists(cls, index_path):
+        return FullVectorStore.exists(index_path)
+
+    def add(self, ids, vectors, texts, metadatas):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.store.add(ids, truncate_vectors(vectors, self.search_dim), texts, metadatas)
+        self.full_vectors.add(ids, vectors)
+
+    def update_metadata(self, ids, metadatas):
+        self.store.update_metadata(ids, metadatas)
+
+    def delete(self, ids):
+        self.store.delete(ids)
+        self.full_vectors.delete(ids)
+
+    def count(self):
+        return self.store.count()
+
+    def search(self, vector, k=4):
+        vector = np.asarray(vector, dtype=np.float32)
+        candidates = self.store.search(truncate_vectors(vector, self.search_dim),
+                                       k * RESCORE_OVERSAMPLE)
+        if not candidates:
+            return []
+
+        distances = self.full_vectors.distances([doc.id for doc, _ in candidates], vector)
+        order = np.argsort(distances, kind="stable")[:k]
+        return [(candidates[i][0], float(distances[i])) for i in order]
+
+    def close(self):
+        self.store.close()
+        self.full_vectors.close()
+
+    def save(self):
+        self.store.save()
+        self.full_vectors.save()
+
+
+class HnswStore(_InProcessStore):
+    """
+    Approximate search with an in-process HNSW graph (hnswlib), tuned
+    with HNSW_M, HNSW_EF_CONSTRUCTION and HNSW_EF_SEARCH. Entries are
+    addressed by integer labels; deleted labels are only marked deleted
+    in the graph and never reused.
+    """
+
+    name = "hnsw"
+    subdir = "hnsw_index"
+
+    def __init__(self, index_path, embedding_function=None):
+        if hnswlib is None:
+            raise ImportError("the hnsw vector backend needs hnswlib (pip install chroma-hnswlib)")
+
+        self._index = None
+        self._labels = {}  # id -> label
+        self._items = {}  # label -> (id, text, metadata)
+        self._next_label = 0
+        super().__init__(index_path, embedding_function)
+
+    def _load(self):
+        chunks = self._load_chunks()
+        self._items = {label: (id_, text, metadata)
+                       for label, id_, text, metadata in chunks["items"]}
+        self._labels = {id_: label for label, (id_, _, _) in self._items.items()}
+        self._next_label = chunks["next_label"]
+
+        self._index = hnswlib.Index(space=self.space, dim=chunks["dim"])
+        self._index.load_index(os.path.join(self.index_dir, "index.bin"))
+
+    def _reserve(self, size, dim):
+        if self._index is None:
+            self._index = hnswlib.Index(space=self.space, dim=dim)
+            self._index.init_index(max_elements=max(size, 1024), M=HNSW_M,
+                                   ef_construction=HNSW_EF_CONSTRUCTION)
+        elif size > self._index.get_max_elements():
+            self._index.resize_index(max(size, 2 * self._index.get_max_elements()))
+
+    def add(self, ids, vectors, texts, metadatas):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        labels = []
+        for id_, text, metadata in zip(ids, texts, metadatas):
+            label = self._labels.get(id_)
+            if label is None:
+                label = self._labels[id_] = self._next_label
+                self._next_label += 1
+            self._items[label] = (id_, text, metadata)
+            labels.append(label)
+
+        # labels include deleted ones, which still occupy the graph
+        self._reserve(self._next_label, vectors.shape[1])
+        self._index.add_items(vectors, np.asarray(labels, dtype=np.int64))
+
+    def update_metadata(self, ids, metadatas):
+        for id_, metadata in zip(ids, metadatas):
+            label = self._labels.get(id_)
+            if label is not None:
+                _, text, old = self._items[label]
+                self._items[label] = (id_, text, {**old, **metadata})
+
+    def delete(self, ids):
+        for id_ in ids:
+            label = self._labels.pop(id_, None)
+            if label is not None:
+                self._index.mark_deleted(label)
+                del self._items[label]
+
+    def count(self):
+        return len(self._labels)
+
+    def vectors(self):
+        """The vectors of the entries, in label order."""
+        labels = sorted(self._labels.values())
+        if not labels:
+            return None
+        return np.asarray(self._index.get_items(labels), dtype=np.float32)
+
+    def search(self, vector, k=4):
+        k = min(k, self.count())
+        if k == 0:
+            return []
+
+        self._index.set_ef(max(HNSW_EF_SEARCH, k))
+        labels, distances = self._index.knn_query(np.asarray(vector, dtype=np.float32), k=k)
+
+        results = []
+        for label, distance in zip(labels[0], distances[0]):
+            id_, text, metadata = self._items[int(label)]
+            results.append((Document(id=id_, page_content=text, metadata=dict(metadata or {})),
+                            float(distance)))
+        return results
+
+    def save(self):
+        if self._index is None:
+            return
+
+        self._save_files(
+            lambda tmp_dir: self._index.save_index(os.path.join(tmp_dir, "index.bin")),
+            {
+                "dim": self._index.dim,
+                "next_label": self._next_label,
+                "items": [[label, id_, text, metadata]
+                          for label, (id_, text, metadata) in self._items.items()],
+            },
+        )
+
+
+STORES = {store.name: store for store in [ChromaStore, NumpyStore, Int8Store, BinaryStore,
+                                          HnswStore]}
+
+
+def get_store_class(backend=None):
+    backend = backend or VECTOR_BACKEND
+    if backend not in STORES:
+        raise ValueError(f"Unknown vector backend {backend!r}, expected one of {sorted(STORES)}")
+    return STORES[backend]
+
+
+def open_store(index_path, embedding_function=None, backend=None, search_dim=None):
+    """
+    Open (or create) the index at index_path with the configured VectorStore.
+
+    search_dim: dimensions of the searched vectors when creating an index
+    (0: full vectors); by default an existing index is opened as it was
+    built, and a new one is created with full vectors.
+    """
+    store = get_store_class(backend)(index_path, embedding_function)
+
+    if search_dim is None and FullVectorStore.exists(index_path):
+        return TruncatedStore(store, FullVectorStore(index_path))
+    if search_dim:
+        return TruncatedStore(store, FullVectorStore(index_path, search_dim))
+    return store
+
+
+def build_store(index_path, ids, vectors, texts, metadatas, backend=None,
+                embedding_function=None, batch_size=1000, search_dim=0):
+    """Create a store at index_path from complete lists of entries and save it."""
+    store = open_store(index_path, embedding_function, backend, search_dim)
+    for i in range(0, len(ids), batch_size):
+        store.add(ids[i:i + batch_size], vectors[i:i + batch_size],
+                  texts[i:i + batch_size], metadatas[i:i + batch_size])
+    store.save()
+    return store
+
+
+def needs_chroma_import(index_path, backend=None):
+    """Whether the selected store has to be imported from the version's Chroma collection."""
+    store = get_store_class(backend)
+    return (getattr(store, "import_chroma", False) and not store.exists(index_path)
+            and ChromaStore.exists(index_path))
+
+
+def import_chroma_version(root, backend=None):
+    """
+    Import the Chroma collection of the current index version under root
+    into the selected in-process store, in a new version that is then
+    published, and return the path of the current version. Processes
+    that call this together wait for the one that imports (on POSIX
+    systems), then find the store already there.
+    """
+    with open(os.path.join(root, "import.lock"), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        index_path = current_index_path(root)
+        if not needs_chroma_import(index_path, backend):
+            return index_path
+
+        # not the pending build: an interrupted index build can still be resumed
+        build_path = start_build(root, index_path, pending=False)
+        chroma = ChromaStore(build_path)
+        get_store_class(backend)(build_path).import_from(chroma)
+        chroma.close()
+        publish_build(root, build_path)
+        return build_path
+
+
+def discard_other_stores(index_path, backend=None):
+    """
+    Remove in-process stores copied from an earlier version that the
+    build did not update, so they are re-imported if selected later.
+    """
+    backend = backend or VECTOR_BACKEND
+    for store in STORES.values():
+        if store.name != backend and getattr(store, "subdir", None):
+            shutil.rmtree(os.path.join(index_path, store.subdir), ignore_errors=True)
@@ -0,0 +1,118 @@
+import os
+import shutil
+import time
+
+# Index builds are written to versions/v<timestamp> under the database
+# root and published by atomically replacing the CURRENT pointer file, so
+# readers never see a half-built index. A database without a CURRENT
+# pointer (e.g. the downloaded one) is read from the root directly.
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+NEXT_FILE = "NEXT"
+KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+
+
+def _read_pointer(root, name):
+    try:
+        with open(os.path.join(root, name), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_pointer(root, name, value):
+    path = os.path.join(root, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(value)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _version_path(root, version):
+    return os.path.join(root, VERSIONS_DIR, version)
+
+
+def current_version(root):
+    return _read_pointer(root, CURRENT_FILE)
+
+
+def current_index_path(root):
+    """Directory of the published index under root."""
+    version = current_version(root)
+    if version is None:
+        return root
+    return _version_path(root, version)
+
+
+def start_build(root, base_path=None, pending=True):
+    """
+    Create a new version directory for a build, seeded with a copy of
+    base_path for incremental updates, and (if pending) remember it as
+    the pending build so an interrupted build can be resumed.
+    """
+    os.makedirs(os.path.join(root, VERSIONS_DIR), exist_ok=True)
+
+    version = "v" + time.strftime("%Y%m%d%H%M%S")
+    suffix = 1
+    while os.path.exists(_version_path(root, version)):
+        version = f"v{time.strftime('%Y%m%d%H%M%S')}_{suffix}"
+        suffix += 1
+    path = _version_path(root, version)
+
+    if base_path is not None:
+        shutil.copytree(
+            base_path, path,
+            ignore=shutil.ignore_patterns(VERSIONS_DIR, CURRENT_FILE + "*", NEXT_FILE + "*"),
+        )
+    else:
+        os.makedirs(path)
+
+    if pending:
+        _write_pointer(root, NEXT_FILE, version)
+    return path
+
+
+def pending_build(root):
+    """Directory of an unfinished build, or None."""
+    version = _read_pointer(root, NEXT_FILE)
+    if version is None or not os.path.isdir(_version_path(root, version)):
+        return None
+    return _version_path(root, version)
+
+
+def discard_build(root, path):
+    shutil.rmtree(path, ignore_errors=True)
+    if _read_pointer(root, NEXT_FILE) == os.path.basename(path):
+        os.remove(os.path.join(root, NEXT_FILE))
+
+
+def publish_build(root, path, keep=KEEP_VERSIONS):
+    """Atomically make a finished build the current index, then prune old versions."""
+    version = os.path.basename(path)
+    _write_pointer(root, CURRENT_FILE, version)
+
+    if _read_pointer(root, NEXT_FILE) == version:
+        os.remove(os.path.join(root, NEXT_FILE))
+
+    prune_versions(root, keep)
+
+
+def prune_versions(root, keep=KEEP_VERSIONS):
+    """
+    Delete all but the newest `keep` versions. The current and pending
+    versions are always kept; the previous ones stay around so readers
+    that have not reloaded yet can finish their queries.
+    """
+    versions_root = os.path.join(root, VERSIONS_DIR)
+    if not os.path.isdir(versions_root):
+        return
+
+    protected = {current_version(root), _read_pointer(root, NEXT_FILE)}
+    versions = sorted(os.listdir(versions_root), reverse=True)
+
+    for version in versions[keep:]:
+        if version not in protected:
+            shutil.rmtree(_version_path(root, version), ignore_errors=True)